@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+
+# Measures Context startup and single service lookup against synthetic swarms
+# of increasing size. The Engine API filtering is simulated by an index, so the
+# numbers reflect the client-side cost only.
+
+import argparse, sys, os, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from traefikswarm import context
+
+class FakeService:
+    def __init__(self, client, name, stack=None, labels=20):
+        self.client = client
+        self.name = name
+        self.id = name
+        spec_labels = {f'traefik.http.routers.{name}-{i}.rule': f'Host(`{name}-{i}`)' for i in range(labels)}
+        if stack:
+            spec_labels['com.docker.stack.namespace'] = stack
+        self.attrs = {
+            'Spec': {
+                'Name': name,
+                'Labels': spec_labels,
+                'TaskTemplate': {
+                    'ContainerSpec': {
+                        'Image': 'nginx:latest',
+                        'Env': [f'VAR{i}=value{i}' for i in range(20)],
+                        'Args': [f'--arg{i}=value{i}' for i in range(20)],
+                    },
+                },
+            },
+        }
+
+class FakeServices:
+    def __init__(self, client, count):
+        self.calls = 0
+        self.returned = 0
+        self.by_name = {}
+        for i in range(count):
+            stack = f'stack{i % 10}' if i % 2 else None
+            name = f'{stack}_svc{i}' if stack else f'svc{i}'
+            self.by_name[name] = FakeService(client, name, stack)
+
+    def list(self, filters=None):
+        self.calls += 1
+        if filters and 'name' in filters:
+            res = [s for s in (self.by_name.get(filters['name']),) if s]
+        else:
+            res = list(self.by_name.values())
+        self.returned += len(res)
+        return res
+
+class FakeClient:
+    def __init__(self, count):
+        self.services = FakeServices(self, count)
+
+class Args:
+    hostname = None
+    stackname = 'stack1'
+
+def run(count, repeat):
+    client = FakeClient(count)
+    context.docker_host = lambda hostname: client
+    start = time.perf_counter()
+    for _ in range(repeat):
+        ctx = context.Context(Args())
+        ctx.get_service('svc1')
+        ctx.get_global_service('svc0')
+    elapsed = (time.perf_counter() - start) / repeat
+    return elapsed, client.services.calls / repeat, client.services.returned / repeat
+
+def main():
+    parser = argparse.ArgumentParser(description='Context discovery benchmark')
+    parser.add_argument('--repeat', type=int, default=100)
+    parser.add_argument('sizes', metavar='SIZE', type=int, nargs='*', default=[10, 100, 1000, 10000])
+    args = parser.parse_args()
+
+    print(f'{"services":>10} {"time/run":>12} {"calls":>6} {"returned":>9}')
+    for count in args.sizes:
+        elapsed, calls, returned = run(count, args.repeat)
+        print(f'{count:>10} {elapsed * 1e6:>10.1f}us {calls:>6.0f} {returned:>9.0f}')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,556 @@
+#!/usr/bin/env python3
+
+# In-process stand-in for the Docker Engine API, served over a unix socket.
+#
+# Covers the subset of the API used by traefikswarm: services, networks,
+# images (including distribution inspect), containers, exec and events. Every
+# request is counted per endpoint with its latency and response size, so
+# benchmarks can report how many API calls a command needs.
+#
+# Usage:
+#   engine = FakeEngine('/tmp/engine.sock')
+#   engine.start()
+#   ... traefikswarm -H unix:///tmp/engine.sock ...
+#   engine.stop()
+
+import os, re, json, time, uuid, hashlib, threading, queue, socketserver
+from collections import defaultdict
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs, unquote
+
+API_VERSION = '1.43'
+
+def _id():
+    return uuid.uuid4().hex + uuid.uuid4().hex[:32]
+
+def _now():
+    return time.strftime('%Y-%m-%dT%H:%M:%S.000000000Z', time.gmtime())
+
+class EngineError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.calls = defaultdict(int)
+            self.time = defaultdict(float)
+            self.bytes = defaultdict(int)
+
+    def record(self, endpoint, elapsed, size):
+        with self.lock:
+            self.calls[endpoint] += 1
+            self.time[endpoint] += elapsed
+            self.bytes[endpoint] += size
+
+    @property
+    def total_calls(self):
+        return sum(self.calls.values())
+
+    @property
+    def total_bytes(self):
+        return sum(self.bytes.values())
+
+class State:
+    """Objects managed by the fake engine"""
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.services = dict()
+        self.networks = dict()
+        self.images = dict()
+        self.containers = dict()
+        self.execs = dict()
+        self.configs = dict()
+        self.secrets = dict()
+        self.subscribers = []
+        self.index = 1
+
+    def next_index(self):
+        self.index += 1
+        return self.index
+
+    def emit(self, type, action, id, name):
+        event = {
+            'Type': type, 'Action': action,
+            'Actor': {'ID': id, 'Attributes': {'name': name}},
+            'scope': 'swarm', 'time': int(time.time()), 'timeNano': time.time_ns(),
+        }
+        for q in list(self.subscribers):
+            q.put(event)
+
+    # population helpers for benchmarks
+
+    def add_service(self, name, image='nginx:latest', labels=None, env=None, args=None, stack=None):
+        labels = dict(labels or {})
+        if stack:
+            labels['com.docker.stack.namespace'] = stack
+        spec = {
+            'Name': name,
+            'Labels': labels,
+            'TaskTemplate': {
+                'ContainerSpec': {'Image': image, 'Env': list(env or []), 'Args': list(args or [])},
+                'Networks': [],
+            },
+            'Mode': {'Replicated': {'Replicas': 1}},
+            'EndpointSpec': {'Mode': 'vip'},
+        }
+        return self.create_service(spec, emit=False)
+
+    def add_network(self, name, labels=None):
+        return self.create_network({'Name': name, 'Driver': 'overlay', 'Labels': labels or {}}, emit=False)
+
+    def add_image(self, ref, entrypoint=None):
+        name, tag = (ref.rsplit(':', 1) + ['latest'])[:2] if ':' in ref.split('/')[-1] else (ref, 'latest')
+        digest = 'sha256:' + hashlib.sha256(f'{name}:{tag}'.encode('utf-8')).hexdigest()
+        image_id = 'sha256:' + hashlib.sha256(f'id:{name}:{tag}'.encode('utf-8')).hexdigest()
+        image = {
+            'Id': image_id,
+            'RepoTags': [f'{name}:{tag}'],
+            'RepoDigests': [f'{name}@{digest}'],
+            'Config': {'Entrypoint': entrypoint},
+            'ContainerConfig': {'Entrypoint': entrypoint},
+        }
+        self.images[image_id] = image
+        return image
+
+    # object operations
+
+    def create_service(self, spec, emit=True):
+        with self.lock:
+            if any(s['Spec']['Name'] == spec['Name'] for s in self.services.values()):
+                raise EngineError(409, f"rpc error: code = AlreadyExists desc = name conflicts with an existing object: service {spec['Name']} already exists")
+            sid = _id()[:25]
+            self.services[sid] = {
+                'ID': sid,
+                'Version': {'Index': self.next_index()},
+                'CreatedAt': _now(),
+                'UpdatedAt': _now(),
+                'Spec': spec,
+            }
+        if emit:
+            self.emit('service', 'create', sid, spec['Name'])
+        return self.services[sid]
+
+    def update_service(self, sid, version, spec):
+        with self.lock:
+            svc = self.find('services', sid)
+            if int(version) != svc['Version']['Index']:
+                raise EngineError(500, 'rpc error: code = Unknown desc = update out of sequence')
+            svc['PreviousSpec'] = svc['Spec']
+            svc['Spec'] = spec
+            svc['Version'] = {'Index': self.next_index()}
+            svc['UpdatedAt'] = _now()
+        self.emit('service', 'update', svc['ID'], spec['Name'])
+        return svc
+
+    def create_network(self, spec, emit=True):
+        with self.lock:
+            nid = _id()[:25]
+            self.networks[nid] = {
+                'Name': spec['Name'], 'Id': nid, 'Created': _now(), 'Scope': 'swarm',
+                'Driver': spec.get('Driver', 'overlay'), 'Attachable': spec.get('Attachable', False),
+                'Labels': spec.get('Labels', None) or {}, 'Containers': {},
+            }
+        if emit:
+            self.emit('network', 'create', nid, spec['Name'])
+        return self.networks[nid]
+
+    def find(self, kind, key):
+        objects = getattr(self, kind)
+        if key in objects:
+            return objects[key]
+        for obj in objects.values():
+            oid = obj.get('ID', obj.get('Id', ''))
+            if oid.split(':')[-1].startswith(key.split(':')[-1]) or obj.get('Spec', obj).get('Name', None) == key:
+                return obj
+            if key in obj.get('RepoTags', ()) or f'{key}:latest' in obj.get('RepoTags', ()):
+                return obj
+        raise EngineError(404, f'{kind[:-1]} {key} not found')
+
+def _filters(query):
+    raw = query.get('filters', [None])[0]
+    if not raw:
+        return {}
+    res = json.loads(raw)
+    # filters are either lists of values or dicts of value: true
+    return {k:(list(v) if isinstance(v, dict) else v) for k, v in res.items()}
+
+def _match_labels(labels, wanted):
+    for w in wanted:
+        k, _, v = w.partition('=')
+        if k not in labels or ('=' in w and labels[k] != v):
+            return False
+    return True
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    routes = []
+
+    def log_message(self, format, *args):
+        pass
+
+    def address_string(self):
+        return 'unix'
+
+    @classmethod
+    def route(cls, method, pattern):
+        def decorator(fn):
+            cls.routes.append((method, re.compile(f'^(?:/v[0-9.]+)?{pattern}$'), fn.__name__, fn))
+            return fn
+        return decorator
+
+    def do_GET(self):
+        self.dispatch('GET')
+
+    def do_POST(self):
+        self.dispatch('POST')
+
+    def do_DELETE(self):
+        self.dispatch('DELETE')
+
+    def do_HEAD(self):
+        self.dispatch('HEAD')
+
+    def dispatch(self, method):
+        start = time.perf_counter()
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        path = unquote(url.path)
+        length = int(self.headers.get('Content-Length', 0) or 0)
+        body = json.loads(self.rfile.read(length) or b'null') if length else None
+
+        endpoint = f'{method} {path}'
+        size = 0
+        try:
+            for m, regex, name, fn in self.routes:
+                match = regex.match(path)
+                if m == method and match:
+                    endpoint = name
+                    size = fn(self, query, body, *match.groups())
+                    break
+            else:
+                raise EngineError(404, f'page not found: {method} {path}')
+        except EngineError as err:
+            size = self.reply({'message': str(err)}, err.status)
+        self.server.engine.stats.record(endpoint, time.perf_counter() - start, size or 0)
+
+    def reply(self, data, status=200):
+        payload = b'' if data is None else json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.send_header('Api-Version', API_VERSION)
+        self.end_headers()
+        self.wfile.write(payload)
+        return len(payload)
+
+    @property
+    def state(self) -> State:
+        return self.server.engine.state
+
+# system
+
+@Handler.route('GET', r'/_ping')
+def ping(self, query, body):
+    self.send_response(200)
+    self.send_header('Content-Length', '2')
+    self.end_headers()
+    self.wfile.write(b'OK')
+    return 2
+
+@Handler.route('GET', r'/version')
+def version(self, query, body):
+    return self.reply({'Version': 'fake', 'ApiVersion': API_VERSION, 'MinAPIVersion': '1.12', 'Os': 'linux', 'Arch': 'amd64'})
+
+@Handler.route('GET', r'/events')
+def events(self, query, body):
+    types = _filters(query).get('type', None)
+    q = queue.Queue()
+    self.state.subscribers.append(q)
+    self.send_response(200)
+    self.send_header('Content-Type', 'application/json')
+    self.send_header('Transfer-Encoding', 'chunked')
+    self.end_headers()
+    self.wfile.flush()
+    size = 0
+    try:
+        while not self.server.engine.stopping:
+            try:
+                event = q.get(timeout=0.2)
+            except queue.Empty:
+                continue
+            if types and event['Type'] not in types:
+                continue
+            data = json.dumps(event).encode('utf-8') + b'\n'
+            self.wfile.write(f'{len(data):x}\r\n'.encode('ascii') + data + b'\r\n')
+            self.wfile.flush()
+            size += len(data)
+    except (BrokenPipeError, ConnectionResetError):
+        pass
+    finally:
+        self.state.subscribers.remove(q)
+        self.close_connection = True
+    return size
+
+# services
+
+@Handler.route('GET', r'/services')
+def services_list(self, query, body):
+    filters = _filters(query)
+    res = []
+    with self.state.lock:
+        for svc in self.state.services.values():
+            spec = svc['Spec']
+            if 'name' in filters and not any(spec['Name'].startswith(n) for n in filters['name']):
+                continue
+            if 'id' in filters and not any(svc['ID'].startswith(i) for i in filters['id']):
+                continue
+            if 'label' in filters and not _match_labels(spec.get('Labels', None) or {}, filters['label']):
+                continue
+            res.append(svc)
+        return self.reply(res)
+
+@Handler.route('GET', r'/services/([^/]+)')
+def services_inspect(self, query, body, sid):
+    return self.reply(self.state.find('services', sid))
+
+@Handler.route('POST', r'/services/create')
+def services_create(self, query, body):
+    return self.reply({'ID': self.state.create_service(body)['ID']}, 201)
+
+@Handler.route('POST', r'/services/([^/]+)/update')
+def services_update(self, query, body, sid):
+    self.state.update_service(sid, query.get('version', ['0'])[0], body)
+    return self.reply({'Warnings': None})
+
+@Handler.route('DELETE', r'/services/([^/]+)')
+def services_remove(self, query, body, sid):
+    with self.state.lock:
+        svc = self.state.find('services', sid)
+        del self.state.services[svc['ID']]
+    self.state.emit('service', 'remove', svc['ID'], svc['Spec']['Name'])
+    return self.reply(None)
+
+# networks
+
+@Handler.route('GET', r'/networks')
+def networks_list(self, query, body):
+    filters = _filters(query)
+    res = []
+    with self.state.lock:
+        for net in self.state.networks.values():
+            # the name filter matches substrings, like the real engine
+            if 'name' in filters and not any(n in net['Name'] for n in filters['name']):
+                continue
+            res.append(net)
+        return self.reply(res)
+
+@Handler.route('GET', r'/networks/([^/]+)')
+def networks_inspect(self, query, body, nid):
+    return self.reply(self.state.find('networks', nid))
+
+@Handler.route('POST', r'/networks/create')
+def networks_create(self, query, body):
+    return self.reply({'Id': self.state.create_network(body)['Id'], 'Warning': ''}, 201)
+
+@Handler.route('POST', r'/networks/([^/]+)/connect')
+def networks_connect(self, query, body, nid):
+    net = self.state.find('networks', nid)
+    net['Containers'][body['Container']] = {}
+    return self.reply(None)
+
+# configs and secrets
+
+@Handler.route('GET', r'/(configs|secrets)')
+def configs_list(self, query, body, kind):
+    filters = _filters(query)
+    names = filters.get('name', None)
+    res = [c for c in getattr(self.state, kind).values() if not names or any(c['Spec']['Name'].startswith(n) for n in names)]
+    if 'label' in filters:
+        res = [c for c in res if _match_labels(c['Spec'].get('Labels', None) or {}, filters['label'])]
+    return self.reply(res)
+
+@Handler.route('GET', r'/(configs|secrets)/([^/]+)')
+def configs_inspect(self, query, body, kind, cid):
+    return self.reply(self.state.find(kind, cid))
+
+@Handler.route('POST', r'/(configs|secrets)/create')
+def configs_create(self, query, body, kind):
+    cid = _id()[:25]
+    getattr(self.state, kind)[cid] = {'ID': cid, 'Version': {'Index': self.state.next_index()}, 'Spec': body}
+    return self.reply({'ID': cid}, 201)
+
+@Handler.route('DELETE', r'/(configs|secrets)/([^/]+)')
+def configs_remove(self, query, body, kind, cid):
+    obj = self.state.find(kind, cid)
+    key = 'ConfigID' if kind == 'configs' else 'SecretID'
+    for svc in self.state.services.values():
+        refs = svc['Spec'].get('TaskTemplate', {}).get('ContainerSpec', {}).get(kind.capitalize(), None) or []
+        if any(r.get(key, None) == obj['ID'] for r in refs):
+            raise EngineError(400, f"rpc error: code = InvalidArgument desc = {kind[:-1]} '{obj['Spec']['Name']}' is in use by the following service: {svc['Spec']['Name']}")
+    del getattr(self.state, kind)[obj['ID']]
+    return self.reply(None, 204)
+
+# images
+
+@Handler.route('GET', r'/images/json')
+def images_list(self, query, body):
+    refs = _filters(query).get('reference', None) or query.get('filter', None)
+    res = []
+    for img in self.state.images.values():
+        if refs and not any(r in img['RepoTags'] or f'{r}:latest' in img['RepoTags'] for r in refs):
+            continue
+        res.append(img)
+    return self.reply(res)
+
+@Handler.route('GET', r'/images/(.+)/json')
+def images_inspect(self, query, body, name):
+    return self.reply(self.state.find('images', name))
+
+@Handler.route('POST', r'/images/create')
+def images_pull(self, query, body):
+    name = query['fromImage'][0]
+    tag = query.get('tag', ['latest'])[0]
+    if ':' in name.split('/')[-1]:
+        name, tag = name.rsplit(':', 1)
+    self.state.add_image(f'{name}:{tag}')
+    time.sleep(self.server.engine.pull_delay)
+    return self.reply({'status': f'Downloaded newer image for {name}:{tag}'})
+
+@Handler.route('GET', r'/distribution/(.+)/json')
+def distribution_inspect(self, query, body, name):
+    if ':' not in name.split('/')[-1]:
+        name += ':latest'
+    digest = 'sha256:' + hashlib.sha256(name.encode('utf-8')).hexdigest()
+    return self.reply({'Descriptor': {'mediaType': 'application/vnd.docker.distribution.manifest.v2+json', 'digest': digest, 'size': 1024}, 'Platforms': []})
+
+# containers and exec
+
+@Handler.route('GET', r'/containers/json')
+def containers_list(self, query, body):
+    filters = _filters(query)
+    res = []
+    for c in self.state.containers.values():
+        if 'label' in filters and not _match_labels(c['Config']['Labels'], filters['label']):
+            continue
+        if 'status' in filters and c['State']['Status'] not in filters['status']:
+            continue
+        res.append({'Id': c['Id'], 'Names': [c['Name']], 'Image': c['Config']['Image'], 'Labels': c['Config']['Labels'], 'State': c['State']['Status']})
+    return self.reply(res)
+
+@Handler.route('POST', r'/containers/create')
+def containers_create(self, query, body):
+    image = self.state.find('images', body['Image'])
+    cid = _id()
+    self.state.containers[cid] = {
+        'Id': cid, 'Name': '/' + query.get('name', [cid[:12]])[0],
+        'Image': image['Id'],
+        'Config': {'Image': body['Image'], 'Labels': body.get('Labels', None) or {}, 'Env': body.get('Env', None), 'Entrypoint': body.get('Entrypoint', None)},
+        'State': {'Status': 'created', 'Running': False},
+        'HostConfig': body.get('HostConfig', {}),
+    }
+    return self.reply({'Id': cid, 'Warnings': []}, 201)
+
+@Handler.route('POST', r'/containers/([^/]+)/start')
+def containers_start(self, query, body, cid):
+    c = self.state.find('containers', cid)
+    c['State'] = {'Status': 'running', 'Running': True}
+    return self.reply(None, 204)
+
+@Handler.route('GET', r'/containers/([^/]+)/json')
+def containers_inspect(self, query, body, cid):
+    return self.reply(self.state.find('containers', cid))
+
+@Handler.route('POST', r'/containers/([^/]+)/kill')
+def containers_kill(self, query, body, cid):
+    c = self.state.find('containers', cid)
+    if c['HostConfig'].get('AutoRemove', False):
+        del self.state.containers[c['Id']]
+    else:
+        c['State'] = {'Status': 'exited', 'Running': False}
+    return self.reply(None, 204)
+
+@Handler.route('POST', r'/containers/([^/]+)/exec')
+def exec_create(self, query, body, cid):
+    c = self.state.find('containers', cid)
+    eid = _id()
+    self.state.execs[eid] = {'ID': eid, 'ContainerID': c['Id'], 'Cmd': body['Cmd'], 'ExitCode': None, 'Running': False}
+    return self.reply({'Id': eid}, 201)
+
+@Handler.route('POST', r'/exec/([^/]+)/start')
+def exec_start(self, query, body, eid):
+    ex = self.state.find('execs', eid)
+    output = (' '.join(ex['Cmd']) + '\n').encode('utf-8') * self.server.engine.exec_repeat
+    self.send_response(101)
+    self.send_header('Content-Type', 'application/vnd.docker.raw-stream')
+    self.send_header('Connection', 'Upgrade')
+    self.send_header('Upgrade', 'tcp')
+    self.end_headers()
+    self.wfile.flush()
+    # give the client time to read the headers before the raw stream starts
+    time.sleep(0.01)
+    self.wfile.write(output)
+    self.wfile.flush()
+    ex['ExitCode'] = 0
+    self.close_connection = True
+    return len(output)
+
+@Handler.route('GET', r'/exec/([^/]+)/json')
+def exec_inspect(self, query, body, eid):
+    return self.reply(self.state.find('execs', eid))
+
+class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+class FakeEngine:
+    def __init__(self, path, pull_delay=0, exec_repeat=1):
+        self.path = path
+        self.state = State()
+        self.stats = Stats()
+        self.pull_delay = pull_delay
+        self.exec_repeat = exec_repeat
+        self.stopping = False
+        self.server = None
+
+    @property
+    def url(self):
+        return f'unix://{self.path}'
+
+    def start(self):
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self.server = Server(self.path, Handler)
+        self.server.engine = self
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.stopping = True
+        if self.server:
+            self.server.shutdown()
+            self.server.server_close()
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+
+if __name__ == '__main__':
+    import argparse, signal
+    parser = argparse.ArgumentParser(description='Run a fake Docker Engine on a unix socket')
+    parser.add_argument('socket', metavar='PATH', help='Unix socket to listen on')
+    parser.add_argument('--services', type=int, default=10, help='Number of synthetic services')
+    args = parser.parse_args()
+
+    engine = FakeEngine(args.socket).start()
+    engine.state.add_network('traefik')
+    for i in range(args.services):
+        engine.state.add_service(f'svc{i}')
+    print(f'Listening on {engine.url}')
+    try:
+        signal.pause()
+    except KeyboardInterrupt:
+        engine.stop()
@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+
+# Measures the cost of ServiceUpdater mutations with growing numbers of
+# arguments and labels. The time per operation should stay constant.
+
+import argparse, sys, os, time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from traefikswarm.dockertools import ServiceUpdater
+
+def run(count):
+    svc = ServiceUpdater.create(object(), 'bench', 'traefik:latest')
+    start = time.perf_counter()
+    for i in range(count):
+        svc.ensure_arg(f'--entrypoints.ep{i}.address', f':{i}')
+        svc.ensure_label(f'traefik.http.routers.r{i}.rule', f'Host(`h{i}`)')
+        svc.ensure_env(f'VAR{i}', str(i))
+    for i in range(0, count, 2):
+        svc.remove_arg(f'--entrypoints.ep{i}.address')
+        svc.remove_label(f'traefik.http.routers.r{i}.rule')
+        svc.remove_env(f'VAR{i}')
+    mutate = time.perf_counter() - start
+    start = time.perf_counter()
+    svc.emit_updates()
+    emit = time.perf_counter() - start
+    return mutate, emit
+
+def main():
+    parser = argparse.ArgumentParser(description='ServiceUpdater mutation benchmark')
+    parser.add_argument('sizes', metavar='SIZE', type=int, nargs='*', default=[100, 1000, 10000])
+    args = parser.parse_args()
+
+    print(f'{"items":>8} {"mutate":>10} {"per op":>10} {"emit":>10}')
+    for count in args.sizes:
+        mutate, emit = run(count)
+        ops = count * 4.5
+        print(f'{count:>8} {mutate * 1e3:>8.1f}ms {mutate / ops * 1e6:>8.2f}us {emit * 1e3:>8.1f}ms')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+
+# Runs traefikswarm commands end to end against the fake Docker Engine with
+# synthetic swarms of increasing size, reporting wall time and the number of
+# Engine API calls per scenario.
+
+import argparse, sys, os, time, tempfile, contextlib, io
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from fakeengine import FakeEngine
+from traefikswarm import command_line, dockertools
+
+SCENARIOS = {
+    'expose': lambda n: ['expose', f'svc{n // 2}', '8080', '-H', f'svc{n // 2}.example.com'],
+    'unexpose': lambda n: ['unexpose', f'svc{n // 2 | 1}'],
+    'config': lambda n: ['config', '--env-add', 'BENCH=1', '--accesslog'],
+    'service': lambda n: ['service', f'svc{n // 2}', '--env-add', 'BENCH=1', '--label-add', 'bench=1'],
+}
+
+def populate(engine: FakeEngine, count, labels):
+    state = engine.state
+    state.add_network('traefik')
+    state.add_image('traefik:2.3')
+    state.add_service('traefik', 'traefik:2.3', args=[
+        '--providers.docker', '--providers.docker.swarmMode=true', '--providers.docker.exposedByDefault=false',
+        '--entrypoints.http.address=:80', '--entrypoints.https.address=:443',
+    ])
+    for i in range(count):
+        name = f'svc{i}'
+        svclabels = {f'app.label{j}': f'value{j}' for j in range(labels)}
+        if i % 2:
+            # every other service is already exposed, with the usual set of traefik labels
+            router = f'{name}-80'
+            svclabels.update({
+                'traefik.enable': 'true',
+                'traefik.docker.network': 'traefik',
+                f'traefik.http.routers.{router}.entryPoints': 'https',
+                f'traefik.http.routers.{router}.service': router,
+                f'traefik.http.routers.{router}.rule': f'Host(`{name}.example.com`)',
+                f'traefik.http.routers.{router}.priority': '130',
+                f'traefik.http.services.{router}.loadbalancer.server.port': '80',
+            })
+        state.add_service(name, env=[f'VAR{j}=value{j}' for j in range(10)], labels=svclabels)
+
+def run(engine: FakeEngine, argv):
+    # start every scenario with a cold process state
+    dockertools._cache.clear()
+    engine.stats.reset()
+    sys.argv = ['traefikswarm', '-H', engine.url, '--commit', '--no-cache', *argv]
+    output = io.StringIO()
+    start = time.perf_counter()
+    code = 0
+    with contextlib.redirect_stdout(output):
+        try:
+            command_line.main()
+        except SystemExit as ex:
+            code = ex.code
+    elapsed = time.perf_counter() - start
+    if code:
+        print(output.getvalue(), file=sys.stderr)
+    return elapsed, code
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark traefikswarm commands against a fake Docker Engine')
+    parser.add_argument('--sizes', metavar='N', help='Swarm sizes to test (default: 10 100 1000 10000)', type=int, nargs='+', default=[10, 100, 1000, 10000])
+    parser.add_argument('--labels', metavar='N', help='Non-traefik labels per service (default: 12)', type=int, default=12)
+    parser.add_argument('--scenario', help='Scenarios to run (default: all)', choices=SCENARIOS, action='append')
+    parser.add_argument('--endpoints', help='Show API calls per endpoint', action='store_true')
+    args = parser.parse_args()
+
+    failed = False
+    print(f"{'scenario':<10} {'services':>9} {'wall ms':>9} {'calls':>6} {'KiB':>9}")
+    for count in args.sizes:
+        with tempfile.TemporaryDirectory() as tmp:
+            engine = FakeEngine(os.path.join(tmp, 'engine.sock')).start()
+            try:
+                populate(engine, count, args.labels)
+                for name in args.scenario or SCENARIOS:
+                    elapsed, code = run(engine, SCENARIOS[name](count))
+                    stats = engine.stats
+                    status = f' FAILED ({code})' if code else ''
+                    failed = failed or bool(code)
+                    print(f'{name:<10} {count:>9} {elapsed * 1000:>9.1f} {stats.total_calls:>6} {stats.total_bytes / 1024:>9.1f}{status}')
+                    if args.endpoints:
+                        for endpoint, calls in sorted(stats.calls.items()):
+                            print(f'    {endpoint:<24} {calls:>4} {stats.time[endpoint] * 1000:>8.1f} ms {stats.bytes[endpoint]:>10} B')
+            finally:
+                engine.stop()
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,41 @@
+#!/usr/bin/env python3
+
+# Measures the time needed to import the CLI and build its argument parser,
+# which is all that --help and argument errors need. Fails if the docker SDK
+# gets imported on this path or the startup exceeds the budget.
+
+import argparse, sys, os, subprocess, time
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+PROBE = '''
+import sys, time
+start = time.perf_counter()
+from traefikswarm import command_line
+command_line.build_parser()
+print(time.perf_counter() - start, 'docker' in sys.modules)
+'''
+
+def main():
+    parser = argparse.ArgumentParser(description='CLI startup benchmark')
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--budget', metavar='MS', help='Maximum median startup time (default: 100)', type=float, default=100)
+    args = parser.parse_args()
+
+    times = []
+    for _ in range(args.repeat):
+        out = subprocess.run([sys.executable, '-c', PROBE], cwd=ROOT, check=True, stdout=subprocess.PIPE, universal_newlines=True).stdout.split()
+        times.append(float(out[0]) * 1000)
+        if out[1] == 'True':
+            print('FAIL: the docker SDK is imported while building the argument parser')
+            sys.exit(1)
+
+    times.sort()
+    median = times[len(times) // 2]
+    print(f'import + parser: median {median:.1f}ms, min {times[0]:.1f}ms, max {times[-1]:.1f}ms')
+    if median > args.budget:
+        print(f'FAIL: startup exceeds the budget of {args.budget:.0f}ms')
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
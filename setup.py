@@ -26,6 +26,7 @@ setuptools.setup(
     },
     install_requires=[
         'docker>=4',
+        'pyyaml',
     ],
-    python_requires='>=3.6',
+    python_requires='>=3.7',
 )
@@ -0,0 +1,112 @@
+import pytest
+from traefikswarm import rules
+
+HOSTS = [
+    ['a.example.com'],
+    ['a.example.com', 'b.example.com'],
+    ['a.example.com', 'b.example.com', 'c.example.com'],
+    ['www.example.com', '*.example.com'],
+    ['a.x.com', 'b.x.com', 'c.x.com', 'd.y.com', '*.z.com', 'e.y.com', 'f.y.com'],
+    ['{sub:[a-z]+}.example.com'],
+    [],
+]
+
+def parse_all(compiled):
+    hosts = []
+    rests = set()
+    for rule, _ in compiled:
+        found, rest = rules.parse_rule(rule)
+        hosts += found
+        rests.add(rest)
+    return hosts, rests
+
+@pytest.mark.parametrize('hosts', HOSTS)
+@pytest.mark.parametrize('rest', ['', 'PathPrefix(`/api`)'])
+@pytest.mark.parametrize('max_terms', [None, 1, 2])
+@pytest.mark.parametrize('merge_min', [0, 3])
+def test_round_trip(hosts, rest, max_terms, merge_min):
+    compiled = rules.compile_rules(hosts, rest, merge_min=merge_min, max_terms=max_terms)
+    parsed, rests = parse_all(compiled)
+    assert sorted(parsed) == sorted(hosts)
+    assert rests == {rest}
+
+@pytest.mark.parametrize('hosts', HOSTS)
+@pytest.mark.parametrize('merge_min', [0, 3])
+def test_compile_is_stable(hosts, merge_min):
+    compiled = rules.compile_rules(hosts, merge_min=merge_min)
+    assert rules.compile_rules(parse_all(compiled)[0], merge_min=merge_min) == compiled
+
+@pytest.mark.parametrize('hosts', HOSTS[:-1])
+def test_tcp_round_trip(hosts):
+    compiled = rules.compile_rules(hosts, tcp=True)
+    assert all(rule.startswith('HostSNI') for rule, _ in compiled)
+    assert sorted(parse_all(compiled)[0]) == sorted(hosts)
+
+@pytest.mark.parametrize('rule, hosts, rest', [
+    # rules written by older versions
+    ('Host(`a.example.com`,`b.example.com`)', ['a.example.com', 'b.example.com'], ''),
+    ('HostRegexp(`{domain:.+}.example.com`)', ['*.example.com'], ''),
+    ('HostSNI(`*`)', [], ''),
+    ('PathPrefix(`/`)', [], ''),
+    # hand-written rules
+    ('Host(`a.example.com`) && PathPrefix(`/api`)', ['a.example.com'], 'PathPrefix(`/api`)'),
+    ('(Host(`a.example.com`) || Host(`b.example.com`)) && Method(`GET`)', ['a.example.com', 'b.example.com'], 'Method(`GET`)'),
+    ('Host(`a.example.com`) || HostRegexp(`{domain:.+}.example.com`)', ['a.example.com', '*.example.com'], ''),
+    ('Host(`a.example.com`) || PathPrefix(`/api`) && Method(`GET`)', [], '(Host(`a.example.com`) || PathPrefix(`/api`) && Method(`GET`))'),
+    ('PathPrefix(`/a(b`) && Host(`a.example.com`)', ['a.example.com'], 'PathPrefix(`/a(b`)'),
+    ('', [], ''),
+])
+def test_parse_rule(rule, hosts, rest):
+    assert rules.parse_rule(rule) == (hosts, rest)
+
+def test_opaque_rule_is_preserved():
+    hosts, rest = rules.parse_rule('Host(`a.example.com`) || Path(`/x`)')
+    [(rule, _)] = rules.compile_rules(hosts + ['b.example.com'], rest)
+    assert rules.parse_rule(rule) == (['b.example.com'], rest)
+
+def test_normalize():
+    assert rules.normalize(['A.Example.com.', 'a.example.com', ' b.example.com ', '', '{X:.+}.example.com']) == ['a.example.com', 'b.example.com', '{X:.+}.example.com']
+
+def test_hosts_are_not_merged_by_default():
+    # traefik derives ACME certificate domains from Host() rules only
+    assert rules.compile_rules(['a.example.com', 'b.example.com', 'c.example.com']) == [
+        ('Host(`a.example.com`,`b.example.com`,`c.example.com`)', rules.PRIORITY_EXACT),
+    ]
+
+def test_merged_hosts_keep_exact_priority():
+    [(rule, priority)] = rules.compile_rules(['a.example.com', 'b.example.com', 'c.example.com'], merge_min=3)
+    assert rule.startswith('HostRegexp')
+    assert priority == rules.PRIORITY_EXACT
+    assert priority == rules.compile_rules(['a.example.com'])[0][1]
+
+def test_exact_hosts_and_wildcards_get_separate_routers():
+    compiled = rules.compile_rules(['www.example.com', '*.example.com'])
+    assert compiled == [
+        ('Host(`www.example.com`)', rules.PRIORITY_EXACT),
+        ('HostRegexp(`{domain:.+}.example.com`)', rules.PRIORITY_REGEXP),
+    ]
+
+def test_priority_classes():
+    exact = rules.compile_rules(['a.example.com'], 'PathPrefix(`/a`)')[0][1]
+    wildcard = rules.compile_rules(['*.example.com'], 'PathPrefix(`/a/very/long/prefix`)')[0][1]
+    catchall = rules.compile_rules([], 'PathPrefix(`/a/very/long/prefix`)')[0][1]
+    assert exact > wildcard > catchall > rules.compile_rules([])[0][1]
+    assert rules.compile_rules(['a.example.com'], 'PathPrefix(`/api`)')[0][1] > rules.compile_rules(['a.example.com'])[0][1]
+
+def test_split_routers():
+    assert rules.split_routers('web-80', ['web-80', 'web-80-r10', 'web-80-r2', 'web-8080-r2', 'web-80-rx']) == ['web-80-r2', 'web-80-r10']
+
+@pytest.mark.parametrize('rule, priority', [
+    ('Host(`a.example.com`)', rules.PRIORITY_EXACT),
+    ('HostRegexp(`{host:(?:a|b|c)}.example.com`)', rules.PRIORITY_EXACT),
+    ('HostRegexp(`{domain:.+}.example.com`)', rules.PRIORITY_REGEXP),
+    ('PathPrefix(`/`)', rules.PRIORITY_CATCHALL),
+])
+def test_rule_priority(rule, priority):
+    assert rules.rule_priority(rule) == priority
+
+def test_legacy_priority():
+    rule = 'Host(`a.example.com`)'
+    assert rules.is_legacy_priority(rule, len(rule) + 100)
+    assert rules.is_legacy_priority('PathPrefix(`/`)', '15')
+    assert not rules.is_legacy_priority(rule, 7)
@@ -1 +1,7 @@
-from traefikswarm.context import Context
+# Context (and the docker SDK) is only imported when used, to keep the CLI startup fast
+
+def __getattr__(name):
+    if name == 'Context':
+        from traefikswarm.context import Context
+        return Context
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,48 @@
+# Persistent caches
+
+import os, json, time, tempfile
+
+def cache_dir(*parts):
+    return os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'traefikswarm', *parts)
+
+class DigestCache:
+    """Cache of image digests resolved from the registry, entries expire after ttl seconds"""
+
+    def __init__(self, ttl, path=None):
+        self.ttl = ttl
+        self.path = path or cache_dir('digests.json')
+        self.entries = dict()
+        self.modified = False
+        try:
+            with open(self.path) as f:
+                self.entries = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+    def get(self, ref):
+        entry = self.entries.get(ref, None)
+        if entry and entry['Time'] > time.time() - self.ttl:
+            return entry['Digest']
+        return None
+
+    def put(self, ref, digest):
+        self.entries[ref] = {'Digest': digest, 'Time': time.time()}
+        self.modified = True
+
+    def save(self):
+        if not self.modified:
+            return
+        limit = time.time() - self.ttl
+        self.entries = {k:v for k,v in self.entries.items() if v['Time'] > limit}
+        _write_json(self.path, self.entries, 'digest cache')
+        self.modified = False
+
+def _write_json(path, data, what):
+    try:
+        os.makedirs(os.path.dirname(path), mode=0o700, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp, path)
+    except OSError as err:
+        print(f'WARNING: Failed to write {what} {path}: {err}')
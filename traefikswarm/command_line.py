@@ -1,16 +1,23 @@
 import argparse
-import os
+import os, sys
 
-from traefikswarm import commands, context
+from traefikswarm import commands
 
-def main():
+def build_parser():
     parser = argparse.ArgumentParser(description='Manage traefik serving a Docker Swarm')
     defaultHost=os.environ.get('TRAEFIKSWARM_HOST')
-    parser.add_argument('-H', '--hostname', metavar='HOST', help=f'Target docker host (default: {defaultHost or "from environment"})', default=defaultHost)
+    parser.add_argument('-H', '--hostname', metavar='HOST', help=f'Target docker host, multiple hosts can be separated by commas, @FILE reads hosts from a file (default: {defaultHost or "from environment"})', default=defaultHost)
     parser.add_argument('-S', '--stackname', metavar='STACK', help=f'Target stack (default: only non-stack services)', default=None)
     parser.add_argument('--init', help='Initialize missing resources', action='store_true')
     parser.add_argument('--commit', help='Commit the changes without asking', action='store_true')
     parser.add_argument('--preview', help='Only preview changes', action='store_true')
+    parser.add_argument('--parallel', metavar='N', help='Apply changes to up to N services concurrently (default: 1)', type=int, default=1)
+    parser.add_argument('--retries', metavar='N', help='Retry updates of services modified concurrently up to N times (default: 3)', type=int, default=3)
+    parser.add_argument('--helper-ttl', metavar='SECONDS', help='Keep helper containers running for reuse by later runs', type=int, default=None)
+    parser.add_argument('--no-cache', help='Do not use the local image digest cache', action='store_true')
+    parser.add_argument('--plan-out', metavar='FILE', help='Save the computed changes as a plan for apply --plan instead of applying them, {host} is replaced by the host name')
+    parser.add_argument('--profile', help='Print Docker API call statistics and phase timings', action='store_true')
+    parser.add_argument('--profile-json', metavar='FILE', help='Write the profile as JSON, {host} is replaced by the host name')
 
     sub = parser.add_subparsers(help='sub-command', metavar='COMMAND', required=True, dest='command')
     for cmd in commands.commands:
@@ -19,7 +26,22 @@ def main():
         if hasattr(cmd, 'configure_argparser'):
             cmd.configure_argparser(cmdparser)
         cmdparser.set_defaults(handler=cmd.execute)
+    return parser
 
+def main():
+    parser = build_parser()
     args = parser.parse_args()
+    args.parser = parser
+
+    # the docker SDK is only loaded once a command actually runs
+    from traefikswarm import context, fleet
+
+    hosts = fleet.parse_hosts(args.hostname)
+    if not hosts:
+        parser.error(f'no hosts found in {args.hostname}')
+    if len(hosts) > 1:
+        sys.exit(fleet.run(args, hosts))
+
+    args.hostname = hosts[0]
     ctx = context.Context(args)
     ctx.run(args.handler)
@@ -8,6 +8,10 @@ __all__ = [
     'expose',
     'unexpose',
     'service',
+    'apply',
+    'watch',
+    'update',
+    'migrate',
 ]
 
 commands = [importlib.import_module(f'.{cmd}', __name__) for cmd in __all__]
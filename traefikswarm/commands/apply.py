@@ -0,0 +1,69 @@
+from __future__ import annotations
+import copy, shlex, sys, typing
+if typing.TYPE_CHECKING:
+    from traefikswarm import Context
+
+HELP = 'run multiple commands from a manifest and apply all changes at once'
+
+def configure_argparser(parser):
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument('-f', '--file', metavar='MANIFEST', help='YAML manifest with a list of commands to run (- for stdin)')
+    source.add_argument('--plan', metavar='FILE', help='Apply a plan saved by --plan-out, without running any commands, {host} is replaced by the host name')
+
+def load_manifest(ctx: Context, filename):
+    import yaml
+
+    if filename == '-':
+        manifest = yaml.safe_load(sys.stdin)
+    else:
+        with open(ctx.relpath(filename)) as f:
+            manifest = yaml.safe_load(f)
+
+    if not isinstance(manifest, list):
+        ctx.abort(f'Manifest {filename} must contain a list of commands')
+
+    res = []
+    for entry in manifest:
+        if isinstance(entry, str):
+            entry = shlex.split(entry)
+        elif isinstance(entry, list):
+            entry = [str(a) for a in entry]
+        else:
+            ctx.abort(f'Invalid manifest entry {entry!r}, expected a command line string or list')
+        if not entry or entry[0] in ('apply', 'watch'):
+            ctx.abort(f'Invalid manifest entry {entry!r}')
+        res.append(entry)
+    return res
+
+def parse_operations(ctx: Context, filename):
+    args = ctx.args
+    res = []
+    for op in load_manifest(ctx, filename):
+        try:
+            opargs = args.parser.parse_args(op, namespace=copy.copy(args))
+        except SystemExit:
+            ctx.abort(f'Invalid arguments in manifest entry: {" ".join(op)}')
+        # all entries share the context, which is bound to a single stack and host
+        if opargs.stackname != ctx.stackname or opargs.hostname != args.hostname:
+            ctx.abort(f'Manifest entry {" ".join(op)} cannot change the stack or host, use separate runs')
+        res.append((op, opargs))
+    return res
+
+def run_operations(ctx: Context, operations):
+    # all commands share the context, so each service is discovered once and
+    # the changes of all commands are merged into a single update per service
+    args = ctx.args
+    try:
+        for op, opargs in operations:
+            print(f"Running {' '.join(op)}...")
+            ctx.args = opargs
+            opargs.handler(ctx)
+    finally:
+        ctx.args = args
+
+def execute(ctx: Context):
+    if ctx.args.plan:
+        from traefikswarm import plan
+        plan.load_plan(ctx, ctx.host_path(ctx.args.plan))
+    else:
+        run_operations(ctx, parse_operations(ctx, ctx.args.file))
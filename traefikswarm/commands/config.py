@@ -1,5 +1,8 @@
-import argparse, os
-from traefikswarm import context
+from __future__ import annotations
+import argparse, os, typing
+from traefikswarm import policy, httpprovider, scope
+if typing.TYPE_CHECKING:
+    from traefikswarm import context
 from collections import OrderedDict
 
 HELP = 'configure traefik service'
@@ -30,6 +33,13 @@ def configure_argparser(parser):
     parser.add_argument('--acme-staging', help=f'Enable use of ACME staging server', action='store_true', default=None)
     parser.add_argument('--acme-no-staging', help=f'Disable use of ACME staging server', action='store_false', dest='acme_staging')
     parser.add_argument('--acme-store', help=f'ACME store')
+    parser.add_argument('--scoped', help=f'Only let the docker provider see services labeled by expose ({scope.LABEL})', action='store_true', default=None)
+    parser.add_argument('--no-scoped', help='Let the docker provider see all services', action='store_false', dest='scoped')
+    parser.add_argument('--refresh', metavar='SECONDS', help='Docker provider swarm polling interval', type=int)
+    parser.add_argument('--watch', help='Enable docker provider polling', action='store_true', default=None)
+    parser.add_argument('--no-watch', help='Disable docker provider polling, routes are only loaded on start', action='store_false', dest='watch')
+    parser.add_argument('--provider', help=f'Routing provider: docker watches service labels, http polls a configuration compiled from them and served by the {httpprovider.HELPER} service (default: keep current)', choices=('docker', 'http'))
+    policy.configure_argparser(parser)
 
 class EntryPoint:
     def __init__(self, name):
@@ -49,14 +59,13 @@ class EntryPoint:
             args.pop('http.tls.domains[0].sans', None)
 
         prefix = f'--entrypoints.{name}.'
-        for key, _ in [i for i in service.args.items()]:
-            if key.startswith(prefix):
-                lkey = key[len(prefix):]
-                if lkey in args:
-                    service.ensure_arg(key, args[lkey])
-                    del(args[lkey])
-                else:
-                    service.remove_arg(key)
+        for key in service.args_under(f'--entrypoints.{name}'):
+            lkey = key[len(prefix):]
+            if lkey in args:
+                service.ensure_arg(key, args[lkey])
+                del(args[lkey])
+            else:
+                service.remove_arg(key)
         for key, value in args.items():
             service.ensure_arg(prefix + key, value)
         if self.port:
@@ -172,11 +181,10 @@ def execute(ctx: context.Context):
 
     # collect entrypoint args
     entrypoints = {}
-    for key, value in traefik.args.items():
+    for key in traefik.args_under('--entrypoints'):
         parts = key.split('.')
-        if parts[0] == '--entrypoints':
-            ep = entrypoints.setdefault(parts[1], EntryPoint(parts[1]))
-            ep.args['.'.join(parts[2:])] = value
+        ep = entrypoints.setdefault(parts[1], EntryPoint(parts[1]))
+        ep.args['.'.join(parts[2:])] = traefik.args[key]
 
     for name in args.entrypoint_rm:
         ep = entrypoints.pop(name, None)
@@ -267,9 +275,30 @@ def execute(ctx: context.Context):
         traefik.remove_args('--api')
         traefik.remove_labels('traefik.http.routers.traefik-api')
 
-    traefik.ensure_arg('--providers.docker')
-    traefik.ensure_arg('--providers.docker.swarmMode', 'true')
-    traefik.ensure_arg('--providers.docker.exposedByDefault', 'false')
+    if args.provider == 'http':
+        # routing is compiled by expose/unexpose and reloaded by traefik, see httpprovider
+        httpprovider.deploy(ctx, traefik)
+    elif args.provider == 'docker' or not httpprovider.enabled(traefik):
+        if httpprovider.enabled(traefik):
+            print(f"Service '{httpprovider.HELPER}' is no longer used, remove it with docker service rm")
+        traefik.remove_args('--providers.http')
+        # older versions mounted the compiled configuration into traefik
+        traefik.remove_args('--providers.file')
+        for ref in [c for c in traefik.configs if c.name.startswith(httpprovider.CONFIG_PREFIX)]:
+            traefik.remove_config(ref.name)
+        traefik.ensure_arg('--providers.docker')
+        traefik.ensure_arg('--providers.docker.swarmMode', 'true')
+        traefik.ensure_arg('--providers.docker.exposedByDefault', 'false')
+        traefik.ensure_mount('/var/run/docker.sock', '/var/run/docker.sock', 'ro')
+        if args.scoped == True:
+            # run migrate first, unlabeled services are no longer routed
+            traefik.ensure_arg('--providers.docker.constraints', scope.CONSTRAINT)
+        elif args.scoped == False:
+            traefik.remove_arg('--providers.docker.constraints')
+        if args.refresh is not None:
+            traefik.ensure_arg('--providers.docker.swarmModeRefreshSeconds', str(args.refresh))
+        if args.watch is not None:
+            traefik.ensure_arg('--providers.docker.watch', str(args.watch).lower())
 
     for arg in args.arg_rm:
         traefik.remove_arg(f'--{arg}')
@@ -286,7 +315,7 @@ def execute(ctx: context.Context):
     for name, ep in entrypoints.items():
         ep.update(traefik, name)
 
-    traefik.ensure_mount('/var/run/docker.sock', '/var/run/docker.sock', 'ro')
+    policy.apply_args(traefik, args)
 
     if ctx.opt_arg('user_add') or ctx.opt_arg('user_rm'):
         users = OrderedDict()
@@ -301,3 +330,8 @@ def execute(ctx: context.Context):
             users[u] = p
         users = ','.join((f'{u}:{p}' for u, p in users.items()))
         traefik.ensure_label('traefik.http.middlewares.traefik-auth.basicauth.users', users)
+
+    scope.stamp(traefik)
+
+    # the API router and auth middleware are defined by traefik's own labels
+    httpprovider.update_routes(ctx, traefik)
@@ -1,13 +1,17 @@
-import re
-from traefikswarm import Context
+from __future__ import annotations
+import re, typing
+from traefikswarm import httpprovider, scope, rules
+if typing.TYPE_CHECKING:
+    from traefikswarm import Context
 
 def configure_argparser(parser):
-    parser.add_argument('service', metavar='SERVICE', help='Service to expose')
-    parser.add_argument('port', metavar='PORT', help='Service port to expose', type=int)
+    parser.add_argument('service', metavar='SERVICE', help='Service to expose, or a glob selecting services (\'*\' for all services of the stack)')
+    parser.add_argument('port', metavar='PORT', help='Service port to expose, {label:KEY} takes it from a service label')
+    parser.add_argument('--label', metavar='KEY[=VALUE]', help='Only select services with the label, can be repeated', action='append')
     parser.add_argument('--entrypoint-add', help='Entrypoints to add', action='append')
     parser.add_argument('--entrypoint-rm', help='Entrypoints to remove', action='append')
-    parser.add_argument('-H', '--host-add', help='Hostname prefixes to add', action='append')
-    parser.add_argument('--host-rm', help='Hostname prefixes to remove', action='append')
+    parser.add_argument('-H', '--host-add', help='Hostname prefixes to add, {service} is replaced by the service name', action='append')
+    parser.add_argument('--host-rm', help='Hostname prefixes to remove, {service} is replaced by the service name', action='append')
     parser.add_argument('--lbswarm', help='Use swarm load balancer', action='store_true', default=None)
     parser.add_argument('--lbtraefik', help='Use traefik load balancer', action='store_true', default=None)
     parser.add_argument('--router', help='Traefik router name override')
@@ -15,15 +19,50 @@ def configure_argparser(parser):
     parser.add_argument('--http', help='Use HTTP for communication with backend (default)', action='store_false', dest='https')
     parser.add_argument('--tcp', help='Expose TCP directly', action='store_true', dest='tcp')
     parser.add_argument('--tls', help='Terminate TLS on TCP endpoint', action='store_true', dest='tls')
+    parser.add_argument('--priority', help='Router priority (default: based on the kind of rule)', type=int)
+    parser.add_argument('--max-hosts', metavar='N', help='Split rules with more than N host terms across several routers', type=int)
+    parser.add_argument('--merge-min', metavar='N', help=f'Merge N or more hosts with a common parent domain into a regexp, traefik does not request ACME certificates for them unless covered by config --acme-domains, 0 disables (default: {rules.MERGE_MIN})', type=int, default=rules.MERGE_MIN)
+
+def is_selector(args):
+    return bool(args.label) or any(c in args.service for c in '*?[')
+
+def select_targets(ctx: Context, args):
+    """Returns the service named by SERVICE, or all services selected by the glob and --label"""
+    if not is_selector(args):
+        # update_routes needs traefik (and its helper), discover them together with the target
+        ctx.prefetch_services((ctx.stackname, args.service), *((None, name) for name in httpprovider.SERVICES))
+        svc = ctx.get_service(args.service) if ctx.stackname else ctx.get_global_service(args.service)
+        if not svc:
+            ctx.abort(f'Service {args.service} not found')
+        return [svc]
+    if args.router:
+        ctx.abort('--router cannot be used when selecting multiple services')
+    services = ctx.select_services(args.service, args.label or (), httpprovider.SERVICES)
+    if not services:
+        print(f'No services selected by {args.service}')
+    return services
+
+def resolve_port(svc, template):
+    try:
+        return int(re.sub(r'\{label:([^}]+)\}', lambda m: svc.labels[m[1]], template))
+    except (KeyError, ValueError):
+        return None
 
 def execute(ctx: Context):
     args = ctx.args
-    name = args.service
-    port = args.port
-    svc = ctx.get_service(name) if ctx.stackname else ctx.get_global_service(name)
+    # all selected services are updated in a single pass over the loaded services
+    for svc in select_targets(ctx, args):
+        port = resolve_port(svc, args.port)
+        if port is None:
+            if not is_selector(args):
+                ctx.abort(f'Invalid port {args.port} for service {svc.name}')
+            print(f'Skipping service {svc.name}, no port {args.port}')
+            continue
+        expose(ctx, svc, port)
 
-    if not svc:
-        ctx.abort(f'Service {name} not found')
+def expose(ctx: Context, svc, port):
+    args = ctx.args
+    service = svc.name[len(ctx.stackname) + 1:] if ctx.stackname else svc.name
 
     router = args.router or f'{svc.name}-{port}'
     protocol = 'tcp' if args.tcp else 'http'
@@ -37,31 +76,24 @@ def execute(ctx: Context):
         if e not in entrypoints:
             entrypoints.append(e)
 
-    hosts = []
-    rule = svc.labels.get(f'{lprefix}.rule', '')
-    match = re.fullmatch('(Host(?:SNI)?(?:Regexp)?)\(`(.+)`\)', rule)
-    if match:
-        if match[1].endswith('Regexp'):
-            hosts = match[2].replace('{domain:.+}', '*').split('`,`')
-        elif not (match[1] == 'HostSNI' and match[2] == '*'):
-            hosts = match[2].split('`,`')
-    
-    for h in args.host_rm or ():
-        hosts.remove(h)
-
-    for h in args.host_add or ():
+    # routers split off by --max-hosts are named {router}-r2, {router}-r3...
+    rprefix = f'traefik.{protocol}.routers'
+    parts = rules.split_routers(router, {k.split('.')[3] for k in svc.labels_under(rprefix)})
+
+    hosts, rest = rules.parse_rule(svc.labels.get(f'{lprefix}.rule', ''))
+    for part in parts:
+        hosts += rules.parse_rule(svc.labels.get(f'{rprefix}.{part}.rule', ''))[0]
+    hosts = rules.normalize(hosts)
+
+    for h in rules.normalize(h.replace('{service}', service) for h in args.host_rm or ()):
+        if h in hosts:
+            hosts.remove(h)
+
+    for h in rules.normalize(h.replace('{service}', service) for h in args.host_add or ()):
         if h not in hosts:
             hosts.append(h)
 
-    wild = any((h for h in hosts if '*' in h))
-    sni = 'SNI' if args.tcp else ''
-    if hosts:
-        if wild:
-            rule = f'Host{sni}Regexp(`' + '`,`'.join((h.replace('*', '{domain:.+}') for h in hosts)) + '`)'
-        else:
-            rule = f'Host{sni}(`' + '`,`'.join(hosts) + '`)'
-    else:
-        rule = 'HostSNI(`*`)' if args.tcp else 'PathPrefix(`/`)'     # catch-all
+    compiled = rules.compile_rules(hosts, rest, tcp=args.tcp, merge_min=args.merge_min, max_terms=args.max_hosts)
 
     if not entrypoints:
         entrypoints = ['https']
@@ -73,19 +105,30 @@ def execute(ctx: Context):
         svc.ensure_label('traefik.docker.lbswarm', 'true')
     elif args.lbtraefik == True:
         svc.remove_label('traefik.docker.lbswarm')
-    svc.ensure_label(f'{lprefix}.entryPoints', ','.join(entrypoints))
-    svc.ensure_label(f'{lprefix}.service', router)
-    svc.ensure_label(f'{lprefix}.rule', rule)
-    if not args.tcp:
-        svc.ensure_label(f'{lprefix}.priority', len(rule) + (0 if wild else 100))
+    names = [router] + [f'{router}-r{i}' for i in range(2, len(compiled) + 1)]
+    for rname, (rule, priority) in zip(names, compiled):
+        prefix = f'{rprefix}.{rname}'
+        svc.ensure_label(f'{prefix}.entryPoints', ','.join(entrypoints))
+        svc.ensure_label(f'{prefix}.service', router)
+        svc.ensure_label(f'{prefix}.rule', rule)
+        if not args.tcp:
+            svc.ensure_label(f'{prefix}.priority', args.priority or priority)
+        if args.tcp:
+            if args.tls:
+                svc.ensure_label(f'{prefix}.tls', '')
+            else:
+                svc.remove_label(f'{prefix}.tls')
+    for part in parts:
+        if part not in names:
+            for key in svc.labels_under(f'{rprefix}.{part}'):
+                svc.remove_label(key)
+
     svc.ensure_label(f'traefik.{protocol}.services.{router}.loadbalancer.server.port', port)
     if not args.tcp:
         if args.https == True:
             svc.ensure_label(f'traefik.http.services.{router}.loadbalancer.server.scheme', 'https')
         elif args.https == False:
             svc.remove_label(f'traefik.http.services.{router}.loadbalancer.server.scheme')
-    if args.tcp:
-        if args.tls:
-            svc.ensure_label(f'{lprefix}.tls', '')
-        else:
-            svc.remove_label(f'{lprefix}.tls')
+
+    scope.stamp(svc)
+    httpprovider.update_routes(ctx, svc)
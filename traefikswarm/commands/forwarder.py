@@ -1,4 +1,7 @@
-from traefikswarm import Context
+from __future__ import annotations
+import typing
+if typing.TYPE_CHECKING:
+    from traefikswarm import Context
 
 HELP = 'create a container for forwarding to another host inside or outside docker'
 
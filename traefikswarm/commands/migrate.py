@@ -0,0 +1,39 @@
+from __future__ import annotations
+import typing
+from traefikswarm import httpprovider, scope, rules
+if typing.TYPE_CHECKING:
+    from traefikswarm import Context
+
+HELP = 'add the scoping label and rule priorities to services exposed by older versions'
+
+def configure_argparser(parser):
+    parser.add_argument('--all', help='Migrate exposed services of all stacks (default: only the target stack)', action='store_true')
+
+def reprioritize(svc):
+    """Replaces router priorities computed from the rule length by older versions, which are
+    not ordered relative to the priority classes assigned by expose now"""
+    for key in list(svc.labels_under('traefik.http.routers')):
+        if not key.endswith('.rule'):
+            continue
+        rule = svc.labels[key]
+        pkey = key[:-len('rule')] + 'priority'
+        priority = svc.labels.get(pkey, None)
+        if priority is not None and rules.is_legacy_priority(rule, priority):
+            svc.ensure_label(pkey, rules.rule_priority(rule))
+
+def execute(ctx: Context):
+    from traefikswarm.dockertools import ServiceUpdater
+
+    if ctx.args.all:
+        # stack services are keyed by their full name here, they are only updated
+        for s in ctx.docker.services.list(filters={'label': 'traefik.enable=true'}):
+            if s.name not in ctx.global_services:
+                ctx.global_services[s.name] = ServiceUpdater(s)
+        services = ctx.global_services
+    else:
+        services = ctx.load_services(lambda s: 'traefik.enable' in s.attrs.get('Spec', {}).get('Labels', {}))
+
+    for svc in list(services.values()):
+        scope.stamp(svc)
+        reprioritize(svc)
+        httpprovider.update_routes(ctx, svc)
@@ -1,4 +1,8 @@
-from traefikswarm import Context
+from __future__ import annotations
+import typing
+from traefikswarm import policy
+if typing.TYPE_CHECKING:
+    from traefikswarm import Context
 
 def configure_argparser(parser):
     parser.add_argument('service', metavar='SERVICE', help='Service to modify')
@@ -8,6 +12,7 @@ def configure_argparser(parser):
     parser.add_argument('--arg-rm', help=f'Argument to remove', action='append', default=[])
     parser.add_argument('--label-add', help=f'Label to add', action='append', default=[])
     parser.add_argument('--label-rm', help=f'Label to remove', action='append', default=[])
+    policy.configure_argparser(parser)
 
 def execute(ctx: Context):
     args = ctx.args
@@ -31,3 +36,5 @@ def execute(ctx: Context):
         svc.ensure_label(*lbl.split('=', 1))
     for lbl in args.label_rm:
         svc.remove_label(lbl)
+
+    policy.apply_args(svc, args)
@@ -1,21 +1,31 @@
-from traefikswarm import Context
+from __future__ import annotations
+import typing
+from traefikswarm import httpprovider, scope, rules
+from traefikswarm.commands.expose import select_targets
+if typing.TYPE_CHECKING:
+    from traefikswarm import Context
 
 def configure_argparser(parser):
-    parser.add_argument('service', metavar='SERVICE', help='Service to un-expose')
+    parser.add_argument('service', metavar='SERVICE', help='Service to un-expose, or a glob selecting services (\'*\' for all services of the stack)')
     parser.add_argument('port', metavar='PORT', help='Port to un-expose', nargs='?', type=int)
     parser.add_argument('--router', help='Traefik router name override')
+    parser.add_argument('--label', metavar='KEY[=VALUE]', help='Only select services with the label, can be repeated', action='append')
 
 def execute(ctx: Context):
-    args = ctx.args
-    name = args.service
-    svc = ctx.get_service(name) if ctx.stackname else ctx.get_global_service(name)
-
-    if not svc:
-        ctx.abort(f'Service {name} not found')
+    for svc in select_targets(ctx, ctx.args):
+        unexpose(ctx, svc)
 
+def unexpose(ctx: Context, svc):
+    args = ctx.args
     if args.port or args.router:
         router = args.router or f'{svc.name}-{args.port}'
-        for remove in [l for l in svc.labels if f'.{router}.' in l]:
-            svc.remove_label(remove)
+        # including the routers split off by expose --max-hosts
+        names = {k.split('.')[3] for k in svc.labels_under('traefik') if k.count('.') >= 3}
+        for segment in [router, *rules.split_routers(router, names)]:
+            for remove in svc.labels_with_segment(segment):
+                svc.remove_label(remove)
     else:
         svc.remove_labels('traefik')
+
+    scope.stamp(svc)
+    httpprovider.update_routes(ctx, svc)
@@ -0,0 +1,60 @@
+from __future__ import annotations
+import typing
+if typing.TYPE_CHECKING:
+    from traefikswarm import Context
+
+HELP = 'update services to the current digest of their images'
+
+def configure_argparser(parser):
+    parser.add_argument('images', metavar='IMAGE[:TAG]', help='Image to update, services are switched to TAG if specified', nargs='+')
+    parser.add_argument('--pull', help='Pull the images to the manager instead of querying the registry for their digests', action='store_true')
+    parser.add_argument('--digest-ttl', metavar='SECONDS', help='Reuse digests resolved from the registry for SECONDS (default: 60)', type=float, default=60)
+    parser.add_argument('-j', '--jobs', metavar='N', help='Resolve up to N images concurrently (default: 4)', type=int, default=4)
+
+def execute(ctx: Context):
+    from concurrent.futures import ThreadPoolExecutor
+    from traefikswarm.dockertools import ImageRef
+    from traefikswarm.cache import DigestCache
+
+    args = ctx.args
+    requested = {}
+    for image in args.images:
+        ref = ImageRef(image)
+        requested[ref.name] = ref.tag
+
+    services = ctx.load_services(lambda s: ImageRef(s.attrs['Spec']['TaskTemplate']['ContainerSpec'].get('Image', '')).name in requested)
+    services = [svc for svc in services.values() if svc.image.name in requested]
+    if not services:
+        print('No services use the specified images')
+        return
+
+    # resolve each distinct image reference only once
+    targets = {svc.name: (svc.image.name, requested[svc.image.name] or svc.image.tag or 'latest') for svc in services}
+    refs = sorted(set(targets.values()))
+
+    cache = DigestCache(args.digest_ttl) if args.digest_ttl > 0 and not ctx.opt_arg('no_cache') else None
+
+    def resolve(ref):
+        name, tag = ref
+        try:
+            return ImageRef(name).find_update(ctx.docker, tag, args.pull, cache)
+        except Exception as err:
+            return err
+
+    print(f'Resolving {len(refs)} image(s)...')
+    with ThreadPoolExecutor(max_workers=max(args.jobs, 1)) as pool:
+        resolved = dict(zip(refs, pool.map(resolve, refs)))
+    if cache:
+        cache.save()
+
+    failed = [f'{name}:{tag}: {err}' for (name, tag), err in resolved.items() if isinstance(err, Exception)]
+    if failed:
+        ctx.abort('Failed to resolve images:\n  ' + '\n  '.join(failed))
+
+    for svc in services:
+        new = resolved[targets[svc.name]]
+        if svc.image.hash != new.hash or svc.image.tag != new.tag:
+            print(f'  {svc.name} ({svc.image.name})')
+            print(f'    current: {svc.image.tag}@{svc.image.hash}')
+            print(f"    new:     {new.tag}@{new.hash or 'local'}")
+            svc.ensure_image(new)
@@ -0,0 +1,165 @@
+from __future__ import annotations
+import json, queue, threading, time, typing
+from traefikswarm.commands import apply
+if typing.TYPE_CHECKING:
+    from traefikswarm import Context
+
+HELP = 'keep services in the state described by a manifest, reconciling on docker events'
+# runs until interrupted, so the output of multi-host runs is streamed per line
+STREAM_OUTPUT = True
+
+def configure_argparser(parser):
+    parser.add_argument('-f', '--file', metavar='MANIFEST', help='YAML manifest with a list of commands describing the desired state', required=True)
+    parser.add_argument('--settle', metavar='SECONDS', help='Time to collect related events before reconciling (default: 1)', type=float, default=1.0)
+    parser.add_argument('--stats', metavar='FILE', help='Write reconcile latency statistics to a JSON file')
+
+def operation_targets(ctx: Context, args):
+    """Returns full names of services modified by an operation, or None if unknown"""
+    if args.command == 'config':
+        return {'traefik'}
+    name = getattr(args, 'service', None) or getattr(args, 'name', None)
+    if getattr(args, 'label', None) or (name and any(c in name for c in '*?[')):
+        # selectors can match any service
+        return None
+    return {ctx.add_stackname(name)} if name else None
+
+class Stats:
+    def __init__(self, filename=None):
+        self.filename = filename
+        self.reconciles = 0
+        self.failures = 0
+        self.last = None
+        self.max = 0
+        self.total = 0
+
+    def record(self, latency, failed=False):
+        self.reconciles += 1
+        self.failures += failed
+        self.last = latency
+        self.max = max(self.max, latency)
+        self.total += latency
+        if self.filename:
+            with open(self.filename, 'w') as f:
+                json.dump({
+                    'reconciles': self.reconciles,
+                    'failures': self.failures,
+                    'latency_last_ms': round(self.last * 1000, 1),
+                    'latency_max_ms': round(self.max * 1000, 1),
+                    'latency_mean_ms': round(self.total / self.reconciles * 1000, 1),
+                }, f)
+
+def reconcile(ctx: Context, operations, stats, since=None):
+    """Applies the operations, returns the names of the services updated by them"""
+    start = time.time()
+    failed = False
+    ctx.updated.clear()
+    try:
+        apply.run_operations(ctx, operations)
+        ctx.apply_changes()
+    except ctx.AbortException as err:
+        print(err)
+        failed = True
+    except Exception as err:
+        # Engine and connection errors must not stop the daemon, the next event retries
+        print(f'Reconcile failed: {err}')
+        failed = True
+    finally:
+        # applied updaters hold stale versions, fetch them again next time
+        for services in (ctx.global_services, ctx.services):
+            for svc in list(services.values()):
+                ctx.forget_service(svc.name)
+
+    latency = time.time() - (since or start)
+    stats.record(latency, failed)
+    print(f'Reconciled {len(operations)} operation(s) in {latency * 1000:.0f} ms')
+    return set(ctx.updated)
+
+def ignore_own(own, updated, settle):
+    """Records services updated by a reconcile, their events are ignored for the settle window"""
+    until = time.time() + settle
+    own.update({name: until for name in updated})
+    for name, expiry in list(own.items()):
+        if expiry < time.time():
+            del own[name]
+
+# queued after the event stream was reconnected, events may have been missed
+RESYNC = {'Type': 'resync'}
+RECONNECT_MAX = 30
+
+def read_events(ctx: Context, events: queue.Queue):
+    delay = 1
+    try:
+        while True:
+            try:
+                for event in ctx.docker.events(decode=True, filters={'type': ['service', 'network']}):
+                    delay = 1
+                    events.put(event)
+                print(f'Docker event stream closed, reconnecting in {delay} s...')
+            except Exception as err:
+                print(f'Docker event stream failed: {err}, reconnecting in {delay} s...')
+            time.sleep(delay)
+            delay = min(delay * 2, RECONNECT_MAX)
+            events.put(RESYNC)
+    finally:
+        events.put(None)
+
+def execute(ctx: Context):
+    args = ctx.args
+    operations = apply.parse_operations(ctx, args.file)
+    targets = [operation_targets(ctx, opargs) for _, opargs in operations]
+    stats = Stats(ctx.relpath(args.stats) if args.stats else None)
+    if not args.preview:
+        # there is nobody to confirm the changes
+        args.commit = True
+
+    events = queue.Queue()
+    threading.Thread(target=read_events, args=(ctx, events), daemon=True).start()
+
+    print(f'Reconciling {len(operations)} operation(s)...')
+    # services updated by this process, mapped to the end of the window to ignore their events
+    own = dict()
+    ignore_own(own, reconcile(ctx, operations, stats), args.settle)
+
+    try:
+        while True:
+            event = events.get()
+            if event is None:
+                ctx.abort('Docker event stream closed')
+            since = event.get('timeNano', time.time() * 1e9) / 1e9
+
+            # collect the burst of events caused by a single change
+            batch = [event]
+            deadline = time.time() + args.settle
+            while time.time() < deadline:
+                try:
+                    event = events.get(timeout=max(deadline - time.time(), 0))
+                except queue.Empty:
+                    break
+                if event is None:
+                    events.put(None)
+                    break
+                batch.append(event)
+
+            changed = set()
+            network_changed = False
+            for event in batch:
+                name = event.get('Actor', {}).get('Attributes', {}).get('name', None)
+                if event is RESYNC:
+                    ctx.networks.clear()
+                    network_changed = True
+                elif event.get('Type') == 'network':
+                    if name in ctx.networks:
+                        ctx.forget_network(name)
+                        network_changed = True
+                elif name and event.get('Action') in ('create', 'update') and own.get(name, 0) >= event.get('timeNano', time.time() * 1e9) / 1e9:
+                    # caused by our own update
+                    continue
+                elif name:
+                    changed.add(name)
+
+            pending = [op for op, opt in zip(operations, targets) if network_changed or opt is None or opt & changed]
+            if pending:
+                print(f"Changed: {', '.join(sorted(changed)) or 'networks'}")
+                ignore_own(own, reconcile(ctx, pending, stats, since), args.settle)
+    except KeyboardInterrupt:
+        pass
@@ -1,5 +1,8 @@
-import sys, os, typing
-from traefikswarm.dockertools import docker_host, ServiceUpdater, Container, ImageRef
+import sys, os, io, re, typing, contextlib, fnmatch
+from concurrent.futures import ThreadPoolExecutor
+from traefikswarm.dockertools import docker_host, ServiceUpdater, Container, ImageRef, container_pool
+from traefikswarm.profiler import Profiler
+from traefikswarm import plan, httpprovider
 
 class Context:
     class AbortException(Exception):
@@ -10,16 +13,24 @@ class Context:
         self.args = args
         self.hostname = args.hostname
         self.stackname = args.stackname
-        self.docker = docker_host(self.hostname)
+        self.profiler = Profiler(self.hostname) if self.opt_arg('profile') or self.opt_arg('profile_json') else None
+        with self.phase('connect'):
+            self.docker = docker_host(self.hostname)
+            if self.profiler:
+                self.profiler.attach(self.docker)
+        # the pool is shared by run_container and ServiceUpdater.run, which has no access to the args
+        container_pool(self.docker, self.opt_arg('helper_ttl'))
+        # services are discovered lazily on first access, see find_service
         self.services = dict()
         self.global_services = dict()
-
-        for svc in (ServiceUpdater(s) for s in self.docker.services.list()):
-            stack = svc.stack
-            if stack is None:
-                self.global_services[svc.name] = svc
-            elif stack == self.stackname:
-                self.services[svc.name[len(self.stackname)+1:]] = svc
+        self.discovered = set()
+        self.networks = dict()
+        # helper updater and the dynamic configuration in HTTP provider mode, see httpprovider
+        self.dynamic_config = None
+        # (name, content) of a dynamic configuration to be created when applying
+        self.pending_config = None
+        # names of the services created or updated by apply_changes, see watch
+        self.updated = set()
 
     @staticmethod
     def abort(*args, **kwargs):
@@ -28,16 +39,34 @@ class Context:
     def relpath(self, path):
         return os.path.join(self.startdir, path)
 
+    def host_path(self, path):
+        """Output file path, {host} is replaced by the host name for multi-host runs"""
+        return self.relpath(path.replace('{host}', re.sub(r'[^\w.-]+', '_', self.hostname or 'local')))
+
     def opt_arg(self, name, default=None):
         return getattr(self.args, name, default)
 
+    def phase(self, name):
+        """Context manager timing a phase of the run when profiling"""
+        return self.profiler.phase(name) if self.profiler else contextlib.nullcontext()
+
     def run(self, handler):
         try:
-            handler(self)
+            with self.phase('handler'):
+                handler(self)
             self.apply_changes()
         except Context.AbortException as err:
             print(err)
             exit(-1)
+        finally:
+            if self.profiler:
+                self.report_profile()
+
+    def report_profile(self):
+        if self.opt_arg('profile'):
+            self.profiler.print_summary()
+        if self.opt_arg('profile_json'):
+            self.profiler.write(self.host_path(self.args.profile_json))
 
     def require_init(self, resType, resName, init=False):
         if not (init or self.opt_arg('init')):
@@ -58,26 +87,135 @@ class Context:
     def traefik_network(self):
         return self.get_network('traefik', forceGlobal=True)
 
+    def prefetch_networks(self, *netnames):
+        netnames = [n for n in netnames if n not in self.networks]
+        if not netnames:
+            return
+        # the names filter matches substrings, so only keep exact matches
+        with self.phase('discovery'):
+            found = {n.name:n for n in self.docker.networks.list(names=netnames) if n.name in netnames}
+        for netname in netnames:
+            self.networks[netname] = found.get(netname, None)
+
     def get_network(self, name='default', forceGlobal=False):
         netname = name if forceGlobal else self.add_stackname(name)
-        networks = self.docker.networks.list(names=[netname])
-        if len(networks):
-            return networks[0]
-        self.require_init('network', netname)
-        return self.docker.networks.create(netname, driver='overlay', labels={} if forceGlobal else self.add_stacklabel(), attachable=True)
+        if not self.networks:
+            # resolve all networks commonly needed by the commands in a single call
+            self.prefetch_networks('traefik', *([self.add_stackname('default')] if self.stackname else []))
+        self.prefetch_networks(netname)
+        network = self.networks[netname]
+        if network is None:
+            self.require_init('network', netname)
+            network = self.networks[netname] = self.docker.networks.create(netname, driver='overlay', labels={} if forceGlobal else self.add_stacklabel(), attachable=True)
+        return network
 
     @property
     def stack_network(self):
         return self.get_network() if self.stackname else None
 
+    def find_service(self, name, stack=None):
+        fullname = f'{stack}_{name}' if stack else name
+        filters = {'name': fullname}
+        if stack:
+            filters['label'] = f'com.docker.stack.namespace={stack}'
+        return self._match_service(filters, fullname, stack)
+
+    def _match_service(self, filters, fullname, stack):
+        # the name filter matches prefixes, so the exact name and stack must be checked here
+        with self.phase('discovery'):
+            found = self.docker.services.list(filters=filters)
+        for s in found:
+            if s.name == fullname and s.attrs.get('Spec', {}).get('Labels', {}).get('com.docker.stack.namespace', None) == stack:
+                return s
+        return None
+
+    def prefetch_services(self, *keys):
+        """Discovers the services given as (stack, name) keys in a single call, stack services
+        must belong to the current stack"""
+        keys = {(f'{stack}_{name}' if stack else name):(stack, name) for stack, name in keys if (stack, name) not in self.discovered}
+        if not keys:
+            return
+        # the name filter matches prefixes of any of the names
+        with self.phase('discovery'):
+            found = self.docker.services.list(filters={'name': list(keys)})
+        for s in found:
+            key = keys.get(s.name, None)
+            if key and s.attrs.get('Spec', {}).get('Labels', {}).get('com.docker.stack.namespace', None) == key[0]:
+                services = self.services if key[0] else self.global_services
+                services.setdefault(key[1], ServiceUpdater(s))
+        self.discovered.update(keys.values())
+
+    def _discover(self, services, name, stack):
+        key = (stack, name)
+        if name not in services and key not in self.discovered:
+            self.discovered.add(key)
+            service = self.find_service(name, stack)
+            if service:
+                services[name] = ServiceUpdater(service)
+        return services.get(name, None)
+
     def get_service(self, name) -> ServiceUpdater:
-        return self.services.get(name, None)
+        if not self.stackname:
+            return self.services.get(name, None)
+        return self._discover(self.services, name, self.stackname)
 
     def pop_service(self, name) -> ServiceUpdater:
+        self.discovered.add((self.stackname, name))
         return self.services.pop(name, None)
 
     def get_global_service(self, name) -> ServiceUpdater:
-        return self.global_services.get(name, None)
+        return self._discover(self.global_services, name, None)
+
+    def load_services(self, predicate=None, aux=()):
+        """Discovers all services of the current stack (or all non-stack services without a stack),
+        predicate can be used to select the raw services that should be loaded, services named
+        in aux are loaded regardless of it when all non-stack services are listed"""
+        services = self.services if self.stackname else self.global_services
+        filters = {'label': f'com.docker.stack.namespace={self.stackname}'} if self.stackname else None
+        with self.phase('discovery'):
+            found = self.docker.services.list(filters=filters)
+        for s in found:
+            if s.attrs.get('Spec', {}).get('Labels', {}).get('com.docker.stack.namespace', None) != self.stackname:
+                continue
+            name = s.name[len(self.stackname)+1:] if self.stackname else s.name
+            if name not in services and (predicate is None or predicate(s) or name in aux):
+                # services skipped by the predicate can still be discovered later
+                self.discovered.add((self.stackname, name))
+                services[name] = ServiceUpdater(s)
+        return services
+
+    def select_services(self, pattern, labels=(), aux=()):
+        """Returns services matching a name glob and all label queries (KEY or KEY=VALUE), discovered
+        in a single call together with the services already loaded, traefik itself is never selected.
+        Non-stack services named in aux are discovered by the same call if possible, but not selected"""
+        def match(name, svclabels):
+            if not self.stackname and (name == 'traefik' or name in aux):
+                return False
+            if not fnmatch.fnmatchcase(name, pattern):
+                return False
+            for query in labels:
+                key, eq, value = query.partition('=')
+                if key not in svclabels or (eq and svclabels[key] != value):
+                    return False
+            return True
+
+        prefix = f'{self.stackname}_' if self.stackname else ''
+        if self.stackname:
+            self.prefetch_services(*((None, name) for name in aux))
+        services = self.load_services(lambda s: match(s.name[len(prefix):], s.attrs.get('Spec', {}).get('Labels', {})), aux)
+        return [svc for name, svc in services.items() if match(name, svc.labels)]
+
+    def forget_service(self, fullname):
+        """Drops a discovered service so it is fetched again on next access"""
+        self.global_services.pop(fullname, None)
+        self.discovered.discard((None, fullname))
+        if self.stackname and fullname.startswith(self.stackname + '_'):
+            name = fullname[len(self.stackname)+1:]
+            self.services.pop(name, None)
+            self.discovered.discard((self.stackname, name))
+
+    def forget_network(self, netname):
+        self.networks.pop(netname, None)
 
     def get_or_deploy_service(self, name, image, init=False) -> ServiceUpdater:
         svc = self.get_service(name)
@@ -105,25 +243,71 @@ class Context:
         return svc
 
     def run_container(self, image, **kwargs) -> Container:
-        return Container(image, client=self.docker, **kwargs)
+        """Returns a helper container from the pool, release() it when done"""
+        return container_pool(self.docker).acquire(image, **kwargs)
 
     def apply_changes(self):
-        if not self.args.commit:
-            changes = False
-            for svc in self.global_services.values():
-                svc.preview()
-                changes = changes or svc.dirty()
-            for svc in self.services.values():
-                svc.preview()
-                changes = changes or svc.dirty()
-            if not changes:
-                print("No changes required")
+        httpprovider.stage(self)
+        plan_out = self.opt_arg('plan_out')
+        if not self.args.commit or plan_out:
+            with self.phase('preview'):
+                changes = False
+                for svc in self.global_services.values():
+                    svc.preview()
+                    changes = changes or svc.dirty()
+                for svc in self.services.values():
+                    svc.preview()
+                    changes = changes or svc.dirty()
+                if not changes:
+                    print("No changes required")
+                else:
+                    if self.pending_config:
+                        print(f"Will publish config {self.pending_config[0]}")
+                    restarts = [svc.name for services in (self.global_services, self.services) for svc in services.values() if svc.dirty() and svc.restarts()]
+                    if restarts:
+                        print(f"Tasks of these services will be restarted: {', '.join(restarts)}")
+                    else:
+                        print("No tasks will be restarted")
+            if plan_out:
+                # the changes are applied later by apply --plan
+                plan.write_plan(self, self.host_path(plan_out))
                 return
-            if self.args.preview:
+            if not changes or self.args.preview:
                 return
             if input("To apply the changes, type 'yes': ") != 'yes':
                 return
-        for svc in self.global_services.values():
-            svc.apply()
-        for svc in self.services.values():
-            svc.apply()
+
+        # global services (traefik itself) are updated before the stack services
+        with self.phase('apply'):
+            httpprovider.commit(self)
+            failures = []
+            for services in (self.global_services, self.services):
+                failures += self._apply_services(list(services.values()))
+            if not failures:
+                httpprovider.prune(self)
+        if failures:
+            print(f'Failed to update {len(failures)} service(s):')
+            for svc, err in failures:
+                print(f'  {svc.name}: {err}')
+            self.abort('Some changes could not be applied')
+
+    def _apply_services(self, services):
+        def apply(svc):
+            # buffer the output so it is printed per service in a stable order
+            out = io.StringIO()
+            try:
+                if svc.dirty():
+                    self.updated.add(svc.name)
+                svc.apply(out=out, retries=max(self.opt_arg('retries') or 0, 0))
+                return out.getvalue(), None
+            except Exception as err:
+                return out.getvalue(), err
+
+        failures = []
+        with ThreadPoolExecutor(max_workers=max(self.opt_arg('parallel') or 1, 1)) as pool:
+            for svc, (output, err) in zip(services, pool.map(apply, services)):
+                print(output, end='')
+                if err:
+                    print(f'Failed to update service {svc.name}: {err}')
+                    failures.append((svc, err))
+        return failures
@@ -1,17 +1,80 @@
 # Docker container manipulation helpers
 
-import os, subprocess, sys, tarfile, base64, io, tempfile
-import json
+import os, subprocess, sys, tarfile, base64, io, tempfile, hashlib, shutil, codecs
+import json, time, threading, copy, functools, random
 import docker
+import docker.errors as docker_errors
 import atexit
 import pprint
 from collections import OrderedDict, namedtuple
+from concurrent.futures import ThreadPoolExecutor
 
 from docker.types import EndpointSpec
 from docker.types.services import ConfigReference, SecretReference
 
+from traefikswarm.cache import cache_dir
+
 _cache = dict()
 _localCache = None
+_entrypoints = dict()
+_pools = dict()
+
+def _extract_secrets(secrets, path):
+    with io.BytesIO(base64.b64decode(secrets)) as f, tarfile.open(fileobj=f, mode='r') as tar:
+        tar.extractall(path=path)
+    os.chmod(path, 0o700)
+    for name in os.listdir(path):
+        os.chmod(os.path.join(path, name), 0o600)
+
+# seconds to keep the certificates of previous secrets
+TLS_KEEP = 24 * 3600
+
+def _tls_material(prefix, secrets):
+    """Returns a directory with the extracted certificates, cached by content hash"""
+    base = cache_dir('tls')
+    try:
+        os.makedirs(base, mode=0o700, exist_ok=True)
+        st = os.stat(base)
+        private = st.st_uid == os.getuid() and not st.st_mode & 0o077
+    except OSError:
+        private = False
+
+    if not private:
+        # never keep the keys in a directory other users can access
+        tmpdir = tempfile.TemporaryDirectory()
+        atexit.register(tmpdir.cleanup)
+        _extract_secrets(secrets, tmpdir.name)
+        return tmpdir.name
+
+    digest = hashlib.sha256(secrets.encode('utf-8')).hexdigest()[:32]
+    path = os.path.join(base, f'{prefix}-{digest}')
+    if not os.path.isdir(path):
+        tmpdir = tempfile.mkdtemp(dir=base)
+        try:
+            _extract_secrets(secrets, tmpdir)
+            os.rename(tmpdir, path)
+        except OSError:
+            # extracted concurrently by another process
+            shutil.rmtree(tmpdir, ignore_errors=True)
+            if not os.path.isdir(path):
+                raise
+        # drop the material of previous secrets for the same prefix, once no process
+        # started recently can still be using it
+        for name in os.listdir(base):
+            old = os.path.join(base, name)
+            if name.startswith(f'{prefix}-') and old != path:
+                try:
+                    if time.time() - os.stat(old).st_mtime > TLS_KEEP:
+                        shutil.rmtree(old, ignore_errors=True)
+                except OSError:
+                    pass
+    else:
+        # the age of the material is the time it was last used
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+    return path
 
 def docker_host(hostname=None):
     global _cache, _localCache
@@ -24,7 +87,10 @@ def docker_host(hostname=None):
     if hostname in _cache:
         return _cache[hostname]
 
-    if hostname.startswith('env:'):
+    if '://' in hostname:
+        # plain Engine URL, e.g. unix:///var/run/docker.sock or tcp://host:2375
+        res = docker.DockerClient(base_url=hostname)
+    elif hostname.startswith('env:'):
         # use host specification from environment variables (for CI)
         prefix = hostname[4:]
         hostvar = f'{prefix}_HOST'
@@ -32,14 +98,10 @@ def docker_host(hostname=None):
         host, secrets = (os.environ.get(hostvar), os.environ.get(secretsvar))
         if host and secrets:
             print(f'Using {hostvar} and {secretsvar} environment variables...')
-            tmpdir = tempfile.TemporaryDirectory()
-            atexit.register(tmpdir.cleanup)
-            tmpdir = tmpdir.name
             if os.path.isfile(secrets):
                 with open(secrets, 'r') as f:
                     secrets = f.read()
-            with io.BytesIO(base64.b64decode(secrets)) as f, tarfile.open(fileobj=f, mode='r') as tar:
-                tar.extractall(path=tmpdir)
+            tmpdir = _tls_material(prefix, secrets)
             res = docker.DockerClient(base_url=host, tls=docker.tls.TLSConfig(
                 client_cert=(os.path.join(tmpdir, 'cert.pem'), os.path.join(tmpdir, 'key.pem')),
                 ca_cert=os.path.join(tmpdir, 'ca.pem'),
@@ -108,13 +170,31 @@ class ImageRef:
             return match[0]
         return None
 
-    def find_update(self, docker : docker.DockerClient, tag, pull=False):
+    def find_registry_digest(self, docker : docker.DockerClient, cache=None):
+        ref = self.imageWithTag
+        digest = cache and cache.get(ref)
+        if not digest:
+            # only fetches the manifest descriptor, the image is not pulled
+            digest = docker.images.get_registry_data(ref).id
+            if cache:
+                cache.put(ref, digest)
+        return digest
+
+    def find_update(self, docker : docker.DockerClient, tag, pull=False, cache=None):
         res = ImageRef()
         res.name = self.name
         res.tag = tag
 
-        new = None if pull else res.find(docker)
-        if new is None:
+        if not pull:
+            try:
+                res.hash = res.find_registry_digest(docker, cache)
+                return res
+            except docker_errors.APIError:
+                # not available from a registry, look for a local image
+                new = res.find(docker)
+                if new is None:
+                    raise
+        else:
             new = docker.images.pull(res.imageWithTag)
 
         repoDigests = new.attrs['RepoDigests']
@@ -124,8 +204,114 @@ class ImageRef:
             res.hash = None
         return res
 
+class KeyIndex:
+    """Index of dotted keys (labels, arguments) answering prefix and segment queries"""
+
+    def __init__(self, keys=()):
+        self.root = dict()
+        self.segments = dict()
+        for key in keys:
+            self.add(key)
+
+    def add(self, key):
+        parts = key.split('.')
+        node = self.root
+        for part in parts:
+            node = node.setdefault(part, dict())
+        node[None] = key
+        for part in parts[1:-1]:
+            self.segments.setdefault(part, dict())[key] = None
+
+    def remove(self, key):
+        parts = key.split('.')
+        path = [self.root]
+        for part in parts:
+            node = path[-1].get(part, None)
+            if node is None:
+                return
+            path.append(node)
+        if path[-1].pop(None, None) is None:
+            return
+        # prune the nodes left empty
+        for i in range(len(parts), 0, -1):
+            if path[i]:
+                break
+            del path[i - 1][parts[i - 1]]
+        for part in set(parts[1:-1]):
+            keys = self.segments[part]
+            keys.pop(key, None)
+            if not keys:
+                del self.segments[part]
+
+    @staticmethod
+    def _collect(node, res):
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            for part, child in reversed(list(node.items())):
+                if part is None:
+                    res.append(child)
+                else:
+                    stack.append(child)
+        return res
+
+    def _node(self, parts):
+        node = self.root
+        for part in parts:
+            node = node.get(part, None)
+            if node is None:
+                return None
+        return node
+
+    def under(self, path):
+        """Returns all keys starting with path followed by a dot"""
+        node = self._node(path.split('.'))
+        res = []
+        if node:
+            for part, child in node.items():
+                if part is not None:
+                    self._collect(child, res)
+        return res
+
+    def match(self, prefix):
+        """Returns all keys equal to prefix or continuing with a non-alphanumeric character"""
+        parts = prefix.split('.')
+        last = parts.pop()
+        node = self._node(parts)
+        res = []
+        if node:
+            for part, child in node.items():
+                if part == last or part is not None and part.startswith(last) and not part[len(last)].isalnum():
+                    self._collect(child, res)
+        return res
+
+    def with_segment(self, segment):
+        """Returns all keys containing the segment surrounded by dots"""
+        parts = segment.split('.')
+        keys = self.segments.get(parts[0], {})
+        if len(parts) == 1:
+            return list(keys)
+        return [k for k in keys if f'.{segment}.' in k]
+
+def _intent(method):
+    """Records top-level calls of an updater method, so they can be replayed against a fresh spec"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self._depth:
+            return method(self, *args, **kwargs)
+        self.intent.append((method.__name__, args, kwargs))
+        self._depth += 1
+        try:
+            return method(self, *args, **kwargs)
+        finally:
+            self._depth -= 1
+    return wrapper
+
 class ServiceUpdater:
     ANY_VALUE = object()
+    # updates outside of the task template do not restart the tasks, except for the
+    # endpoint spec, tasks created with different published ports are replaced
+    NO_RESTART_UPDATES = {'labels', 'update_config', 'rollback_config'}
     IDName = namedtuple('IDName', ('id', 'name'))
 
     def __init__(self, service: docker.models.services.Service, client=None, name=None):
@@ -133,13 +319,18 @@ class ServiceUpdater:
         if service:
             self.client = service.client
             self.name = service.name
-            self.spec = service.attrs.get('Spec', {})
+            # keep the service attributes intact for comparison, see original
+            self.spec = copy.deepcopy(service.attrs.get('Spec', {}))
         else:
             if not client or not name:
                 raise Exception(f'Client and name must be specified when creating new services')
             self.client = client
             self.name = name
             self.spec = {}
+        self._original = None
+        # ensure_*/remove_* calls made by the commands, see refresh
+        self.intent = []
+        self._depth = 0
         self.reset()
 
     def reset(self):
@@ -150,6 +341,8 @@ class ServiceUpdater:
         self.image = ImageRef(self.cspec.get('Image', ''))
         self.env = dict(k.split('=', 1) for k in self.cspec.get('Env', []))
         self.args = ServiceUpdater.parse_args(self.cspec.get('Args', []))
+        self.label_index = KeyIndex(self.labels)
+        self.arg_index = KeyIndex(self.args)
         self.mounts = {m['Target']:(m['Source'],'ro' if m.get('ReadOnly', False) else 'rw') for m in self.cspec.get('Mounts', [])}
         self.placement = self.template.get('Placement', {})
         self.constraints = self.placement.get('Constraints', [])
@@ -158,7 +351,12 @@ class ServiceUpdater:
         self.ports = self.endpoint_spec.get('Ports', [])
         self.secrets = [SecretReference(s['SecretID'], s['SecretName']) for s in self.cspec.get('Secrets', [])]
         self.configs = {self.IDName(c['ConfigID'], c['ConfigName']):c['File']['Name'] for c in self.cspec.get('Configs', [])}
+        self.update_config = self.spec.get('UpdateConfig', None) or {}
+        self.rollback_config = self.spec.get('RollbackConfig', None) or {}
 
+        # fields are only marked as modified here, the updates are emitted once
+        # by emit_updates() to avoid re-serializing them on every change
+        self.modified = set()
         self.updates = dict()
 
     @staticmethod
@@ -176,27 +374,31 @@ class ServiceUpdater:
     def get_env(self, key):
         return self.env.get(key, None)
 
+    @_intent
     def ensure_constraint(self, constraint):
         if not constraint in self.constraints:
             self.constraints.append(constraint)
-            self.updates['constraints'] = self.constraints
+            self.modified.add('constraints')
 
+    @_intent
     def ensure_env(self, key, value):
         if self.env.get(key, None) != value:
             if value is None:
                 self.env.pop(key)
             else:
                 self.env[key] = value
-            self.updates['env'] = [f'{k}={v}' for (k,v) in self.env.items()]
+            self.modified.add('env')
 
+    @_intent
     def remove_env(self, key):
         if self.env.pop(key, None):
-            self.updates['env'] = [f'{k}={v}' for (k,v) in self.env.items()]
+            self.modified.add('env')
 
+    @_intent
     def ensure_network(self, network):
         if not network.id in self.networks:
             self.networks.append(network.id)
-            self.updates['networks'] = self.networks
+            self.modified.add('networks')
 
     def has_label(self, name, value=ANY_VALUE):
         if not name in self.labels:
@@ -205,25 +407,38 @@ class ServiceUpdater:
             return False
         return True
 
+    @_intent
     def ensure_label(self, name, value):
         if not value is None:
             value = str(value)
         if self.labels.get(name, None) != value:
             if value is None:
                 self.labels.pop(name)
+                self.label_index.remove(name)
             else:
+                if name not in self.labels:
+                    self.label_index.add(name)
                 self.labels[name] = value
-            self.updates['labels'] = self.labels
+            self.modified.add('labels')
 
+    @_intent
     def remove_label(self, name):
         if self.labels.pop(name, None) is not None:
-            self.updates['labels'] = self.labels
+            self.label_index.remove(name)
+            self.modified.add('labels')
 
+    @_intent
     def remove_labels(self, prefix):
-        remove = [k for k in self.labels if k == prefix or k.startswith(prefix) and not k[len(prefix)].isalnum()]
-        for k in remove:
+        for k in self.label_index.match(prefix):
             self.remove_label(k)
 
+    def labels_under(self, path):
+        return self.label_index.under(path)
+
+    def labels_with_segment(self, segment):
+        return self.label_index.with_segment(segment)
+
+    @_intent
     def ensure_clabel(self, name, value):
         if not value is None:
             value = str(value)
@@ -232,7 +447,7 @@ class ServiceUpdater:
                 self.clabels.pop(name)
             else:
                 self.clabels[name] = value
-            self.updates['container_labels'] = self.clabels
+            self.modified.add('container_labels')
 
     @staticmethod
     def _obj_match(obj, **kwargs):
@@ -243,6 +458,7 @@ class ServiceUpdater:
                 return False
         return True
 
+    @_intent
     def ensure_port(self, port, override=None, **kwargs):
         match = next((p for p in self.ports if ServiceUpdater._obj_match(p, **kwargs)), None)
         if match and not override:
@@ -254,7 +470,7 @@ class ServiceUpdater:
             match['PublishedPort'] = port
         else:
             self.ports.append(dict(kwargs, PublishedPort=port))
-        self.updates['endpoint_spec'] = EndpointSpec(ports={ p['PublishedPort']: (p['TargetPort'], p.get('Protocol', 'tcp')) for p in self.ports })
+        self.modified.add('endpoint_spec')
 
     def emit_args(self):
         return [k if v is None else f'{k}={v}' for (k,v) in self.args.items()]
@@ -270,31 +486,59 @@ class ServiceUpdater:
             return False
         return True
 
+    @_intent
     def remove_arg(self, arg):
-        if self.args.pop(arg, None) is not None:
-            self.updates['args'] = self.emit_args()
+        if arg in self.args:
+            del self.args[arg]
+            self.arg_index.remove(arg)
+            self.modified.add('args')
 
+    @_intent
     def remove_args(self, prefix):
-        remove = [k for k in self.args if k == prefix or k.startswith(prefix) and not k[len(prefix)].isalnum()]
-        for k in remove:
+        for k in self.arg_index.match(prefix):
             self.remove_arg(k)
 
+    def args_under(self, path):
+        return self.arg_index.under(path)
+
+    @_intent
     def ensure_arg(self, arg, value=None):
         if not arg in self.args or self.args[arg] != value:
+            if not arg in self.args:
+                self.arg_index.add(arg)
             self.args[arg] = value
-            self.updates['args'] = self.emit_args()
+            self.modified.add('args')
 
+    @_intent
     def ensure_args(self, *args):
-        if len(self.args) != len(args) or args != self.emit_args():
+        if len(self.args) != len(args) or list(args) != self.emit_args():
             self.args = self.parse_args(args)
-            self.updates['args'] = self.emit_args()
-
+            self.arg_index = KeyIndex(self.args)
+            self.modified.add('args')
+
+    @_intent
+    def ensure_update_config(self, key, value, rollback=False):
+        config = self.rollback_config if rollback else self.update_config
+        if not config:
+            # the Engine defaults to updating all tasks at once, use the docker CLI defaults instead
+            config.update(Parallelism=1, FailureAction='pause')
+        if config.get(key, None) != value:
+            config[key] = value
+            self.modified.add('rollback_config' if rollback else 'update_config')
+
+    @_intent
     def ensure_mount(self, target, source, options='rw'):
         value = (source,options)
         if not target in self.mounts or self.mounts[target] != value:
             self.mounts[target] = value
-            self.updates['mounts'] = [f'{v[0]}:{k}:{v[1]}' for k,v in self.mounts.items()]
+            self.modified.add('mounts')
 
+    @_intent
+    def remove_mount(self, target):
+        if self.mounts.pop(target, None):
+            self.modified.add('mounts')
+
+    @_intent
     def ensure_secret(self, secret):
         if isinstance(secret, str):
             secret = self.client.secrets.get(secret)
@@ -302,8 +546,9 @@ class ServiceUpdater:
 
         if not secret in self.secrets:
             self.secrets.append(secret)
-            self.updates['secrets'] = self.secrets
+            self.modified.add('secrets')
 
+    @_intent
     def ensure_config(self, config, filename=None):
         if isinstance(config, str):
             config = self.client.configs.get(config)
@@ -312,7 +557,13 @@ class ServiceUpdater:
 
         if not key in self.configs or self.configs[key] != filename:
             self.configs[key] = filename
-            self.updates['configs'] = [ConfigReference(c.id, c.name, filename=f) for (c,f) in self.configs.items()]
+            self.modified.add('configs')
+
+    @_intent
+    def remove_config(self, name):
+        for key in [k for k in self.configs if k.name == name]:
+            del self.configs[key]
+            self.modified.add('configs')
 
     def update_image(self, images=None, pull=False):
         tag = self.image.find_update_tag(images)
@@ -323,11 +574,92 @@ class ServiceUpdater:
             new = self.image.find_update(self.client, tag, pull)
             print(f"{new.tag}@{new.hash or 'local'}")
             if self.image.hash != new.hash:
-                self.image = new
-                self.updates['image'] = self.image.format()
+                self.ensure_image(new)
+
+    @_intent
+    def ensure_image(self, image):
+        if type(image) is str:
+            image = ImageRef(image)
+        if image.format() != self.image.format():
+            self.image = image
+            self.modified.add('image')
+
+    def emit_updates(self):
+        emitters = {
+            'constraints': lambda: self.constraints,
+            'env': lambda: [f'{k}={v}' for (k,v) in self.env.items()],
+            'networks': lambda: self.networks,
+            'labels': lambda: self.labels,
+            'container_labels': lambda: self.clabels,
+            'endpoint_spec': lambda: EndpointSpec(ports={ p['PublishedPort']: (p['TargetPort'], p.get('Protocol', 'tcp')) for p in self.ports }),
+            'args': self.emit_args,
+            'mounts': lambda: [f'{v[0]}:{k}:{v[1]}' for k,v in self.mounts.items()],
+            'secrets': lambda: self.secrets,
+            'configs': lambda: [ConfigReference(c.id, c.name, filename=f) for (c,f) in self.configs.items()],
+            'image': lambda: self.image.format(),
+            'update_config': lambda: dict(self.update_config),
+            'rollback_config': lambda: dict(self.rollback_config),
+        }
+        for field in self.modified:
+            if self.service and self.normalized(field) == self.original.normalized(field):
+                # equivalent to the current spec, nothing to update
+                self.updates.pop(field, None)
+            else:
+                self.updates[field] = emitters[field]()
+        self.modified.clear()
+        return self.updates
+
+    @property
+    def original(self):
+        """Updater for the unmodified spec of the service"""
+        if self._original is None:
+            self._original = ServiceUpdater(self.service)
+        return self._original
+
+    def normalized(self, field):
+        """Returns the value of an update field in a form independent of ordering and formatting"""
+        if field == 'constraints':
+            return sorted(self.constraints)
+        if field == 'env':
+            return dict(self.env)
+        if field == 'networks':
+            return set(self.networks)
+        if field == 'labels':
+            return dict(self.labels)
+        if field == 'container_labels':
+            return dict(self.clabels)
+        if field == 'endpoint_spec':
+            return {(p['PublishedPort'], p['TargetPort'], p.get('Protocol', 'tcp')) for p in self.ports}
+        if field == 'args':
+            # the order of options does not matter, positional arguments keep theirs
+            if all(k.startswith('-') for k in self.args):
+                return sorted(self.emit_args())
+            return self.emit_args()
+        if field == 'mounts':
+            return dict(self.mounts)
+        if field == 'secrets':
+            return {s['SecretID'] for s in self.secrets}
+        if field == 'configs':
+            return dict(self.configs)
+        if field == 'image':
+            return self.image.format()
+        if field == 'update_config':
+            return dict(self.update_config)
+        if field == 'rollback_config':
+            return dict(self.rollback_config)
+        return None
 
     def pending(self):
-        return len(self.updates)
+        return len(self.emit_updates())
+
+    def restarts(self):
+        """Checks if the pending updates change the task template, which restarts all tasks"""
+        return not self.service or any(f not in self.NO_RESTART_UPDATES for f in self.emit_updates())
+
+    def describe(self):
+        if not self.service:
+            return 'create'
+        return 'update, restarts tasks' if self.restarts() else 'update, no restart'
 
     def dirty(self):
         return not self.service or self.pending()
@@ -336,19 +668,48 @@ class ServiceUpdater:
         if not self.service:
             print(f'Will create service {self.name}: {self}')
         elif self.pending():
-            print(f'Will update service {self.name}: {self}')
-
-    def apply(self):
+            print(f'Will update service {self.name} ({self.describe()}): {self}')
+
+    def apply(self, out=None, retries=0, backoff=0.5):
+        """Applies the pending updates, if the service was modified concurrently it is fetched
+        again and the recorded changes are replayed, up to retries times"""
+        for attempt in range(retries + 1):
+            try:
+                self._apply(out)
+                return
+            except docker_errors.APIError as err:
+                if attempt == retries or not self.intent or not self.is_conflict(err):
+                    raise
+            delay = backoff * 2 ** attempt * random.uniform(1, 1.5)
+            print(f'Service {self.name} was modified concurrently, retrying in {delay:.1f} s...', file=out)
+            time.sleep(delay)
+            self.refresh()
+
+    def _apply(self, out):
         if not self.service:
-            print(f'Creating service {self.name}: {self}')
-            self.client.services.create(self.image.format(), name=self.name, **self.updates)
+            print(f'Creating service {self.name}: {self}', file=out)
+            self.client.services.create(self.image.format(), name=self.name, **self.emit_updates())
         elif self.pending():
-            print(f'Updating service {self.name}: {self}')
+            print(f'Updating service {self.name} ({self.describe()}): {self}', file=out)
             self.service.update(**self.updates)
         self.updates.clear()
 
+    @staticmethod
+    def is_conflict(err):
+        return 'out of sequence' in str(err.explanation or err)
+
+    def refresh(self):
+        """Fetches the current spec of the service and replays the recorded changes on it"""
+        self.service.reload()
+        self.spec = copy.deepcopy(self.service.attrs.get('Spec', {}))
+        self._original = None
+        self.reset()
+        intent, self.intent = self.intent, []
+        for name, args, kwargs in intent:
+            getattr(self, name)(*args, **kwargs)
+
     def __str__(self):
-        return pprint.pformat(self.updates)
+        return pprint.pformat(self.emit_updates())
 
     def run(self):
         return self.get_container(use_existing=False);
@@ -360,32 +721,132 @@ class ServiceUpdater:
         if container:
             return Container(container)
         else:
-            return Container(self.image, client=self.client, networks=self.networks, environment=self.env)
+            return container_pool(self.client).acquire(self.image, networks=self.networks, environment=self.env)
+
+def container_pool(client, ttl=None):
+    pool = _pools.get(id(client), None)
+    if pool is None:
+        pool = _pools[id(client)] = ContainerPool(client)
+    if ttl is not None:
+        pool.ttl = ttl
+    return pool
+
+class ContainerPool:
+    """Reuses helper containers with the same image, networks and settings.
+
+    Without a ttl, the containers are killed when the process exits. With a ttl,
+    they are labelled, left running for ttl seconds and reused by later runs."""
+
+    LABEL = 'traefikswarm.helper'
+    EXPIRES_LABEL = 'traefikswarm.helper.expires'
+    MIN_REMAINING = 60
+
+    def __init__(self, client, ttl=None):
+        self.client = client
+        self.ttl = ttl
+        self.idle = dict()
+        self.in_use = set()
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def key(image, networks=None, **kwargs):
+        spec = json.dumps([str(image), list(networks or ()), kwargs], sort_keys=True, default=str)
+        return hashlib.sha1(spec.encode('utf-8')).hexdigest()[:16]
+
+    def acquire(self, image, networks=None, **kwargs) -> 'Container':
+        key = self.key(image, networks, **kwargs)
+        with self.lock:
+            idle = self.idle.get(key, None)
+            container = idle.pop() if idle else None
+        if container is None and self.ttl:
+            container = self._find_running(key)
+        if container is None:
+            container = self._spawn(key, image, networks, kwargs)
+        with self.lock:
+            self.in_use.add(container.container.id)
+        return container
+
+    def release(self, container):
+        with self.lock:
+            self.in_use.discard(container.container.id)
+            self.idle.setdefault(container.pool_key, []).append(container)
+
+    def spawn(self, count, image, networks=None, **kwargs):
+        """Starts count idle containers concurrently"""
+        key = self.key(image, networks, **kwargs)
+        with ThreadPoolExecutor(max_workers=max(count, 1)) as pool:
+            containers = list(pool.map(lambda _: self._spawn(key, image, networks, kwargs), range(count)))
+        with self.lock:
+            self.idle.setdefault(key, []).extend(containers)
+
+    def _find_running(self, key):
+        limit = time.time() + self.MIN_REMAINING
+        for c in self.client.containers.list(filters={'label': f'{self.LABEL}={key}', 'status': 'running'}):
+            with self.lock:
+                if c.id in self.in_use or any(c.id == i.container.id for i in self.idle.get(key, ())):
+                    continue
+            if float(c.labels.get(self.EXPIRES_LABEL, 0)) > limit:
+                print(f'Reusing container {c.short_id}')
+                container = Container(c)
+                container.pool = self
+                container.pool_key = key
+                return container
+        return None
+
+    def _spawn(self, key, image, networks, kwargs):
+        if self.ttl:
+            kwargs = dict(kwargs, labels=dict(kwargs.get('labels', None) or {}, **{
+                self.LABEL: key,
+                self.EXPIRES_LABEL: str(int(time.time() + self.ttl)),
+            }))
+        container = Container(image, client=self.client, networks=networks, ttl=self.ttl, **kwargs)
+        container.pool = self
+        container.pool_key = key
+        return container
 
 class Container:
-    def __init__(self, imageOrContainer, client=None, networks=None, **kwargs):
+    def __init__(self, imageOrContainer, client=None, networks=None, ttl=None, **kwargs):
+        self.pool = None
+        self.pool_key = None
         if isinstance(imageOrContainer, docker.models.containers.Container):
             self.container = imageOrContainer
             self.kill_atexit = None
         else:
             image = str(imageOrContainer)
-            print(f'Spawning container {image}...', end='', flush=True)
             if networks and len(networks):
                 kwargs['network'] = networks[0]
                 additionalNetworks = [client.networks.get(n) for n in networks[1:]]
             else:
                 additionalNetworks = []
-            self.container = client.containers.run(image, entrypoint=['sleep', 'infinity'], detach=True, remove=True, healthcheck={}, **kwargs)
-            def kill_atexit():
-                self.kill()
+            # with a ttl the container terminates (and is removed) on its own
+            sleep = str(int(ttl)) if ttl else 'infinity'
+            self.container = client.containers.run(image, entrypoint=['sleep', sleep], detach=True, remove=True, healthcheck={}, **kwargs)
+            if ttl:
+                self.kill_atexit = None
+            else:
+                def kill_atexit():
+                    self.kill()
 
-            self.kill_atexit = kill_atexit
-            atexit.register(kill_atexit)
+                self.kill_atexit = kill_atexit
+                atexit.register(kill_atexit)
 
             for net in additionalNetworks:
                 net.connect(self.container)
 
-            print(self.container.short_id)
+            print(f'Spawned container {image}: {self.container.short_id}')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+    def release(self):
+        """Returns the container to its pool for reuse, or kills it"""
+        if self.pool:
+            self.pool.release(self)
+        else:
+            self.kill()
 
     def kill(self):
         if self.kill_atexit:
@@ -395,16 +856,38 @@ class Container:
             print(f'Destroying container {self.container.short_id}...')
             self.container.kill()
 
-    def exec(self, *command, line=None, ignore_error=False, entrypoint_override=False, environment=None):
+    @property
+    def entrypoint(self):
+        image = self.container.attrs.get('Image', None)
+        if image not in _entrypoints:
+            attrs = self.container.image.attrs
+            config = attrs.get('Config', None) or attrs.get('ContainerConfig', None) or {}
+            _entrypoints[image] = config.get('Entrypoint', None)
+        return _entrypoints[image]
+
+    def exec(self, *command, line=None, ignore_error=False, entrypoint_override=False, environment=None, echo=True, output=None):
+        """Runs the command in the container, streaming its output to stdout (if echo is set),
+        to the output file and to the line callback, called with each complete line"""
         if not entrypoint_override:
-            entrypoint = self.container.image.attrs['ContainerConfig']['Entrypoint']
+            entrypoint = self.entrypoint
             if entrypoint:
                 command = (*entrypoint, *command)
         exec_id = self.container.client.api.exec_create(self.container.id, command, tty=True, environment=environment)['Id']
-        for r in self.container.client.api.exec_start(exec_id, stream=True):
-            os.write(1, r)
-            if line:
-                line(r.decode('utf-8'))
+        framer = LineFramer(line) if line else None
+        sink = open(output, 'wb') if output else None
+        try:
+            for r in self.container.client.api.exec_start(exec_id, stream=True):
+                if echo:
+                    os.write(1, r)
+                if sink:
+                    sink.write(r)
+                if framer:
+                    framer.feed(r)
+            if framer:
+                framer.close()
+        finally:
+            if sink:
+                sink.close()
         resp = self.container.client.api.exec_inspect(exec_id)
         err = resp['ExitCode']
         if not ignore_error and err != 0:
@@ -413,6 +896,36 @@ class Container:
 
         return resp
 
+class LineFramer:
+    """Splits a stream of byte chunks into lines, decoding characters split across chunks"""
+    MAX_LINE = 64 * 1024
+
+    def __init__(self, callback, max_line=MAX_LINE):
+        self.callback = callback
+        self.max_line = max_line
+        self.decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+        self.pending = ''
+
+    def feed(self, chunk):
+        text = self.decoder.decode(chunk)
+        if '\n' in text:
+            lines = (self.pending + text).split('\n')
+            self.pending = lines.pop()
+            for l in lines:
+                self.callback(l.rstrip('\r'))
+        else:
+            self.pending += text
+        # never buffer more than max_line characters of an unterminated line
+        while len(self.pending) > self.max_line:
+            self.callback(self.pending[:self.max_line])
+            self.pending = self.pending[self.max_line:]
+
+    def close(self):
+        text = self.pending + self.decoder.decode(b'', final=True)
+        self.pending = ''
+        if text:
+            self.callback(text.rstrip('\r'))
+
 class CommandArgs:
     def __init__(self, args):
         self.args = dict(a.split('=', 1) for a in args)
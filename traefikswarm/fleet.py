@@ -0,0 +1,138 @@
+# Running a command against multiple docker hosts
+
+import sys, io, copy, threading, traceback
+from concurrent.futures import ThreadPoolExecutor
+
+from traefikswarm import context
+
+def parse_hosts(spec):
+    """Parses a comma separated list of hosts, @FILE entries name files with one host per line"""
+    if not spec:
+        return [spec]
+    hosts = []
+    for entry in spec.split(','):
+        entry = entry.strip()
+        if entry.startswith('@'):
+            with open(entry[1:]) as f:
+                for line in f:
+                    line = line.split('#', 1)[0].strip()
+                    if line:
+                        hosts.append(line)
+        elif entry:
+            hosts.append(entry)
+    # keep the order, but run every host only once
+    return list(dict.fromkeys(hosts))
+
+class ThreadOutput(io.TextIOBase):
+    """Redirects writes from worker threads to per-thread buffers"""
+
+    def __init__(self, default):
+        self.default = default
+        self.local = threading.local()
+
+    def capture(self, buffer=None):
+        self.local.buffer = buffer or io.StringIO()
+        return self.local.buffer
+
+    @property
+    def target(self):
+        return getattr(self.local, 'buffer', None) or self.default
+
+    def write(self, s):
+        return self.target.write(s)
+
+    def flush(self):
+        self.target.flush()
+
+class PrefixedOutput(io.TextIOBase):
+    """Writes complete lines to the target as they are produced, prefixed by the host name"""
+
+    def __init__(self, target, prefix, lock):
+        self.target = target
+        self.prefix = prefix
+        self.lock = lock
+        self.pending = ''
+
+    def write(self, s):
+        *lines, self.pending = (self.pending + s).split('\n')
+        if lines:
+            with self.lock:
+                for line in lines:
+                    self.target.write(f'{self.prefix}{line}\n')
+                self.target.flush()
+        return len(s)
+
+    def getvalue(self):
+        # everything was written already, except an unterminated last line
+        if self.pending:
+            self.write('\n')
+        return ''
+
+def run_interruptible(fn, hosts):
+    """Runs fn for every host in a daemon thread, returns None when interrupted by Ctrl+C,
+    which is only delivered to the main thread"""
+    results = [None] * len(hosts)
+    def run_one(i, hostname):
+        results[i] = fn(hostname)
+    threads = [threading.Thread(target=run_one, args=(i, h), daemon=True) for i, h in enumerate(hosts)]
+    for t in threads:
+        t.start()
+    try:
+        for t in threads:
+            while t.is_alive():
+                t.join(0.5)
+    except KeyboardInterrupt:
+        return None
+    return results
+
+def run(args, hosts):
+    # commands running until interrupted (watch) cannot buffer their output, they never prompt either
+    streamed = getattr(sys.modules[args.handler.__module__], 'STREAM_OUTPUT', False)
+    if not (args.commit or args.preview or getattr(args, 'plan_out', None) or streamed):
+        print('ERROR: Changes to multiple hosts cannot be confirmed interactively, use --preview or --commit')
+        return 1
+
+    lock = threading.Lock()
+
+    def run_host(hostname):
+        output = sys.stdout.capture(PrefixedOutput(sys.stdout.default, f'[{hostname}] ', lock) if streamed else None)
+        try:
+            hostargs = copy.copy(args)
+            hostargs.hostname = hostname
+            ctx = context.Context(hostargs)
+            ctx.run(args.handler)
+            err = None
+        except SystemExit as ex:
+            err = f'exit code {ex.code}' if ex.code else None
+        except Exception as exc:
+            traceback.print_exc(file=output)
+            err = str(exc) or type(exc).__name__
+        return output.getvalue(), err
+
+    stdout = sys.stdout
+    sys.stdout = ThreadOutput(stdout)
+    try:
+        if streamed:
+            results = run_interruptible(run_host, hosts)
+            if results is None:
+                return 0
+        else:
+            with ThreadPoolExecutor(max_workers=len(hosts)) as pool:
+                results = list(pool.map(run_host, hosts))
+    finally:
+        sys.stdout = stdout
+
+    failures = []
+    for hostname, (output, err) in zip(hosts, results):
+        if not streamed:
+            print(f'=== {hostname} ===')
+            print(output, end='')
+        if err:
+            failures.append((hostname, err))
+
+    if failures:
+        print(f'Failed on {len(failures)} of {len(hosts)} host(s):')
+        for hostname, err in failures:
+            print(f'  {hostname}: {err}')
+        return 1
+    return 0
@@ -0,0 +1,235 @@
+# Routing served to traefik's HTTP provider
+#
+# In HTTP provider mode the traefik labels of the services are still maintained
+# by expose/unexpose, but traefik does not watch the swarm. The labels are
+# compiled into a dynamic configuration, which is stored in a swarm config
+# named by its content hash. A small helper service serves it to traefik, which
+# polls it and reloads the routes without restarting. Only the helper is
+# updated when the routing changes, its previous task keeps serving the old
+# routes until the new one is running.
+
+from __future__ import annotations
+import typing
+if typing.TYPE_CHECKING:
+    from traefikswarm import Context
+    from traefikswarm.dockertools import ServiceUpdater
+
+HELPER = 'traefik-dynamic'
+HELPER_IMAGE = 'busybox:1.36'
+SERVE_DIR = '/www'
+DYNAMIC_PATH = f'{SERVE_DIR}/routes.json'
+ENDPOINT = f'http://{HELPER}/routes.json'
+POLL_INTERVAL = '5s'
+# global services looked up by update_routes, commands prefetch them with their targets
+SERVICES = ('traefik', HELPER)
+CONFIG_PREFIX = 'traefik-dynamic-'
+LABEL = 'traefikswarm.dynamic'
+# ID of a staged config until it is created, see commit
+PENDING_ID = '(pending)'
+
+# label keys are case-insensitive, the dynamic configuration uses these spellings
+_KEYS = {k.lower():k for k in ('entryPoints', 'loadBalancer', 'certResolver', 'basicAuth', 'passHostHeader', 'stripPrefix', 'redirectScheme', 'healthCheck')}
+_LISTS = {'entrypoints', 'middlewares', 'users', 'prefixes', 'sans'}
+
+def enabled(traefik: ServiceUpdater):
+    return traefik.has_arg('--providers.http.endpoint')
+
+def _value(key, value):
+    if key in _LISTS:
+        return [v for v in value.split(',') if v]
+    if key == 'priority':
+        return int(value)
+    if value in ('true', 'false'):
+        return value == 'true'
+    return value
+
+def compile_labels(host, labels):
+    """Converts traefik labels of a service to a dynamic configuration fragment"""
+    res = {}
+    servers = {}
+    for key, value in labels.items():
+        parts = key.split('.')
+        if len(parts) < 5 or parts[0] != 'traefik' or parts[1] not in ('http', 'tcp', 'udp'):
+            continue
+        protocol, kind, name, path = parts[1], parts[2].lower(), parts[3], [p.lower() for p in parts[4:]]
+        section = res.setdefault(protocol, {}).setdefault(kind, {}).setdefault(name, {})
+        if kind == 'services' and path[:2] == ['loadbalancer', 'server'] and len(path) == 3:
+            # the backend is reached through the service VIP on the traefik network
+            servers.setdefault((protocol, name), {})[path[2]] = value
+            continue
+        if path == ['tls'] and value in ('', 'true'):
+            section.setdefault('tls', {})
+            continue
+        for p in path[:-1]:
+            p = _KEYS.get(p, p)
+            if not isinstance(section.get(p, None), dict):
+                section[p] = {}
+            section = section[p]
+        section[_KEYS.get(path[-1], path[-1])] = _value(path[-1], value)
+
+    for (protocol, name), server in servers.items():
+        if 'port' not in server:
+            continue
+        if protocol == 'http':
+            entry = {'url': f"{server.get('scheme', 'http')}://{host}:{server['port']}"}
+        else:
+            entry = {'address': f"{host}:{server['port']}"}
+        res[protocol]['services'][name].setdefault('loadBalancer', {})['servers'] = [entry]
+
+    # entries without any usable settings are not valid in the dynamic configuration
+    for kinds in res.values():
+        for entries in kinds.values():
+            for name in [n for n, e in entries.items() if not e]:
+                del entries[name]
+    return res
+
+def _names(fragment):
+    return {(protocol, kind, name) for protocol, kinds in fragment.items() for kind, entries in kinds.items() for name in entries}
+
+class DynamicConfig:
+    def __init__(self, data=None):
+        self.data = data or {}
+        # entries compiled from each service, replaced when the service changes
+        self.owned = {}
+
+    def remove(self, names):
+        for protocol, kind, name in names:
+            kinds = self.data.get(protocol, {})
+            kinds.get(kind, {}).pop(name, None)
+            if not kinds.get(kind, True):
+                del kinds[kind]
+            if not self.data.get(protocol, True):
+                del self.data[protocol]
+
+    def merge(self, fragment):
+        for protocol, kinds in fragment.items():
+            for kind, entries in kinds.items():
+                self.data.setdefault(protocol, {}).setdefault(kind, {}).update(entries)
+
+    def update_service(self, svc: ServiceUpdater):
+        old = self.owned.get(svc.name, None)
+        if old is None:
+            old = _names(compile_labels(svc.name, svc.original.labels)) if svc.service else set()
+        fragment = compile_labels(svc.name, svc.labels)
+        self.remove(old)
+        self.merge(fragment)
+        self.owned[svc.name] = _names(fragment)
+
+    def dump(self):
+        import json
+        return json.dumps(self.data, indent=2, sort_keys=True) + '\n'
+
+def _mounted(helper: ServiceUpdater):
+    return [c for c, filename in helper.configs.items() if filename == DYNAMIC_PATH]
+
+def dynamic_config(ctx: Context):
+    """Returns the dynamic configuration served to traefik, or None if traefik does not use the HTTP provider"""
+    traefik = ctx.get_global_service('traefik')
+    if not traefik or not enabled(traefik):
+        return None
+    helper = ctx.get_global_service(HELPER)
+    if not helper:
+        ctx.abort(f"Service '{HELPER}' serving the routes to traefik not found, run config --provider http")
+    if ctx.dynamic_config and ctx.dynamic_config[0] is helper:
+        return ctx.dynamic_config[1]
+
+    import base64, json
+    data = None
+    for ref in _mounted(helper):
+        config = ctx.docker.configs.get(ref.id)
+        data = json.loads(base64.b64decode(config.attrs['Spec']['Data']))
+    ctx.dynamic_config = (helper, DynamicConfig(data))
+    return ctx.dynamic_config[1]
+
+def update_routes(ctx: Context, svc: ServiceUpdater):
+    """Compiles the traefik labels of the service into the dynamic configuration, if used"""
+    config = dynamic_config(ctx)
+    if config:
+        config.update_service(svc)
+
+def deploy(ctx: Context, traefik: ServiceUpdater):
+    """Switches traefik to the HTTP provider and deploys the helper serving the routes"""
+    from traefikswarm.dockertools import ServiceUpdater
+
+    traefik.remove_args('--providers.docker')
+    traefik.remove_mount('/var/run/docker.sock')
+    traefik.ensure_arg('--providers.http.endpoint', ENDPOINT)
+    traefik.ensure_arg('--providers.http.pollInterval', POLL_INTERVAL)
+
+    helper = ctx.get_global_service(HELPER)
+    if not helper:
+        print(f"Creating global service '{HELPER}'...")
+        helper = ctx.global_services[HELPER] = ServiceUpdater.create(ctx.docker, HELPER, HELPER_IMAGE)
+    helper.ensure_args('httpd', '-f', '-p', '80', '-h', SERVE_DIR)
+    helper.ensure_network(ctx.traefik_network)
+    helper.ensure_update_config('Order', 'start-first')
+    rebuild(ctx, traefik, helper)
+
+def rebuild(ctx: Context, traefik: ServiceUpdater, helper: ServiceUpdater):
+    """Compiles the dynamic configuration from the labels of all exposed services in the swarm"""
+    config = DynamicConfig()
+    for s in ctx.docker.services.list(filters={'label': 'traefik.enable=true'}):
+        if s.name != traefik.name:
+            fragment = compile_labels(s.name, s.attrs.get('Spec', {}).get('Labels', {}))
+            config.merge(fragment)
+            config.owned[s.name] = _names(fragment)
+    config.owned[traefik.name] = set()
+    config.update_service(traefik)
+    ctx.dynamic_config = (helper, config)
+
+def stage(ctx: Context):
+    """Mounts the modified dynamic configuration into the helper under its content hash name,
+    the swarm config itself is only created by commit() when the changes are applied"""
+    if not ctx.dynamic_config:
+        return
+    traefik = ctx.get_global_service('traefik')
+    if not traefik or not enabled(traefik):
+        return
+    helper, config = ctx.dynamic_config
+    import hashlib
+    content = config.dump()
+    name = CONFIG_PREFIX + hashlib.sha256(content.encode('utf-8')).hexdigest()[:16]
+    mounted = _mounted(helper)
+    if [c.name for c in mounted] == [name]:
+        return
+    for c in mounted:
+        helper.remove_config(c.name)
+    helper.ensure_config(helper.IDName(PENDING_ID, name), DYNAMIC_PATH)
+    ctx.pending_config = (name, content)
+
+def commit(ctx: Context):
+    """Creates the staged swarm config, if it does not exist yet, and points the helper's mount to it"""
+    if not ctx.pending_config:
+        return
+    name, content = ctx.pending_config
+    # the name filter matches prefixes
+    config = next((c for c in ctx.docker.configs.list(filters={'name': name}) if c.name == name), None)
+    if not config:
+        print(f'Creating config {name}...')
+        config = ctx.docker.configs.create(name=name, data=content.encode('utf-8'), labels={LABEL: 'true'})
+
+    helper = ctx.get_global_service(HELPER)
+    if any(c.name == name for c in helper.configs):
+        helper.remove_config(name)
+        helper.ensure_config(config, DYNAMIC_PATH)
+    # services loaded from a plan only carry the emitted updates
+    for ref in helper.updates.get('configs', []):
+        if ref['ConfigID'] == PENDING_ID:
+            ref['ConfigID'] = config.id
+
+def prune(ctx: Context):
+    """Removes dynamic configurations no longer mounted after the staged one was applied"""
+    if not ctx.pending_config:
+        return
+    name = ctx.pending_config[0]
+    ctx.pending_config = None
+    from docker import errors
+    for config in ctx.docker.configs.list(filters={'label': f'{LABEL}=true'}):
+        if config.name == name or not config.name.startswith(CONFIG_PREFIX):
+            continue
+        try:
+            config.remove()
+            print(f'Removed config {config.name}')
+        except errors.APIError as err:
+            # still in use, e.g. by a helper of another setup
+            print(f'WARNING: Failed to remove config {config.name}: {err.explanation or err}')
@@ -0,0 +1,74 @@
+# Saved plans: updates computed by one run and applied by another
+#
+# A plan records the updates of every changed service together with the service
+# ID and the Version.Index they were computed against. Applying a plan fetches
+# only these services and refuses to touch any that changed in the meantime,
+# the Engine rejects updates with a stale version as well.
+
+from __future__ import annotations
+import json, typing
+from traefikswarm.dockertools import ServiceUpdater
+if typing.TYPE_CHECKING:
+    from traefikswarm import Context
+
+FORMAT = 1
+
+def _entry(svc: ServiceUpdater, name, is_global):
+    return {
+        'name': name,
+        'global': is_global,
+        'service': svc.name,
+        'id': svc.service.id if svc.service else None,
+        'index': svc.service.attrs.get('Version', {}).get('Index', None) if svc.service else None,
+        'image': None if svc.service else svc.image.format(),
+        'updates': svc.emit_updates(),
+    }
+
+def write_plan(ctx: Context, filename):
+    entries = []
+    for services, is_global in ((ctx.global_services, True), (ctx.services, False)):
+        for name, svc in services.items():
+            if svc.dirty():
+                entries.append(_entry(svc, name, is_global))
+    plan = {'format': FORMAT, 'host': ctx.hostname, 'stack': ctx.stackname, 'services': entries}
+    if ctx.pending_config:
+        # the dynamic configuration of the HTTP provider is only created when applying
+        plan['config'] = dict(zip(('name', 'content'), ctx.pending_config))
+    with open(filename, 'w') as f:
+        json.dump(plan, f, indent=2)
+    print(f'Plan with {len(entries)} service change(s) written to {filename}')
+
+def load_plan(ctx: Context, filename):
+    """Loads the services of a saved plan into the context, with the planned updates pending"""
+    try:
+        with open(filename) as f:
+            plan = json.load(f)
+    except (OSError, ValueError) as err:
+        ctx.abort(f'Failed to load plan {filename}: {err}')
+    if plan.get('format', None) != FORMAT:
+        ctx.abort(f'Unsupported plan format in {filename}')
+    if plan['host'] != ctx.hostname:
+        ctx.abort(f"Plan {filename} was computed for host {plan['host'] or '(default)'}, not {ctx.hostname or '(default)'}")
+    if plan['stack'] != ctx.stackname:
+        ctx.abort(f"Plan {filename} was computed for stack {plan['stack'] or '(none)'}, not {ctx.stackname or '(none)'}")
+
+    for entry in plan['services']:
+        services = ctx.global_services if entry['global'] else ctx.services
+        stack = None if entry['global'] else ctx.stackname
+        if entry['id'] is None:
+            svc = ServiceUpdater.create(ctx.docker, entry['service'], entry['image'])
+        else:
+            service = ctx._match_service({'id': entry['id']}, entry['service'], stack)
+            if not service:
+                ctx.abort(f"Service {entry['service']} no longer exists, the plan must be computed again")
+            index = service.attrs.get('Version', {}).get('Index', None)
+            if index != entry['index']:
+                ctx.abort(f"Service {entry['service']} was modified after the plan was computed (version {index}, planned against {entry['index']})")
+            svc = ServiceUpdater(service)
+        # the service object keeps the planned version, so the update stays pinned to it
+        svc.updates = entry['updates']
+        ctx.discovered.add((stack, entry['name']))
+        services[entry['name']] = svc
+    if plan.get('config', None):
+        ctx.pending_config = (plan['config']['name'], plan['config']['content'])
+    print(f"Loaded plan with {len(plan['services'])} service change(s) from {filename}")
@@ -0,0 +1,51 @@
+# Rolling update and rollback policy options shared by commands
+
+import re
+
+FIELDS = (
+    # option, spec key, help, conversion
+    ('parallelism', 'Parallelism', 'Number of tasks updated at once (0 = all)', int),
+    ('delay', 'Delay', 'Delay between updates of task groups (e.g. 10s, 500ms)', 'duration'),
+    ('order', 'Order', 'Update order', str),
+    ('failure-action', 'FailureAction', 'Action on failure', str),
+    ('monitor', 'Monitor', 'Time to monitor each task for failure (e.g. 30s)', 'duration'),
+    ('max-failure-ratio', 'MaxFailureRatio', 'Tolerated failure ratio (0-1)', float),
+)
+
+CHOICES = {
+    'update': {
+        'order': ('start-first', 'stop-first'),
+        'failure-action': ('pause', 'continue', 'rollback'),
+    },
+    # a failed rollback cannot be rolled back
+    'rollback': {
+        'order': ('start-first', 'stop-first'),
+        'failure-action': ('pause', 'continue'),
+    },
+}
+
+_UNITS = {'ns': 1, 'us': 1000, 'ms': 1000000, 's': 1000000000, 'm': 60000000000, 'h': 3600000000000}
+
+def parse_duration(value):
+    """Parses a duration such as 10s or 1m30s (plain numbers are seconds) into nanoseconds"""
+    try:
+        return int(float(value) * _UNITS['s'])
+    except ValueError:
+        pass
+    parts = re.findall(r'(\d+(?:\.\d+)?)(ns|us|ms|s|m|h)', value)
+    if not parts or ''.join(n + u for n, u in parts) != value:
+        raise ValueError(f'invalid duration {value}')
+    return int(sum(float(n) * _UNITS[u] for n, u in parts))
+
+def configure_argparser(parser):
+    for kind in ('update', 'rollback'):
+        for option, _, help, conv in FIELDS:
+            parser.add_argument(f'--{kind}-{option}', help=f'{kind.capitalize()} policy: {help}',
+                type=parse_duration if conv == 'duration' else conv, choices=CHOICES[kind].get(option, None), default=None)
+
+def apply_args(svc, args):
+    for kind in ('update', 'rollback'):
+        for option, key, _, _ in FIELDS:
+            value = getattr(args, f'{kind}_{option.replace("-", "_")}', None)
+            if value is not None:
+                svc.ensure_update_config(key, value, rollback=(kind == 'rollback'))
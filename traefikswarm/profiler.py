@@ -0,0 +1,130 @@
+# Instrumentation of Docker API calls and command phases (--profile)
+
+import re, json, time, threading, contextlib
+from collections import OrderedDict
+
+# IDs and image names in request paths are replaced, so calls group by endpoint
+_ENDPOINT_PATTERNS = [
+    (re.compile(r'^/v[0-9.]+(/.*)$'), r'\1'),
+    (re.compile(r'^/(images|distribution)/.+/(json|history|push|tag|get)$'), r'/\1/{name}/\2'),
+    (re.compile(r'^/(\w+)/(?!json$|create$|prune$|load$|search$|get$)[^/]+(/.*)?$'), r'/\1/{id}\2'),
+]
+
+PHASES = ('connect', 'discovery', 'handler', 'preview', 'apply')
+
+def endpoint(method, url):
+    path = re.sub(r'^[a-z+]+://[^/]*', '', url).split('?', 1)[0]
+    for regex, repl in _ENDPOINT_PATTERNS:
+        path = regex.sub(repl, path)
+    return f'{method} {path}'
+
+class EndpointStats:
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.time = 0.0
+        self.max = 0.0
+        self.sent = 0
+        self.received = 0
+
+    def as_dict(self):
+        return OrderedDict([
+            ('calls', self.calls),
+            ('errors', self.errors),
+            ('time_ms', round(self.time * 1000, 1)),
+            ('max_ms', round(self.max * 1000, 1)),
+            ('sent_bytes', self.sent),
+            ('received_bytes', self.received),
+        ])
+
+class Profiler:
+    """Collects per-endpoint Docker API statistics and exclusive phase timings,
+    time spent in a nested phase is not counted in the enclosing one"""
+
+    def __init__(self, hostname=None):
+        self.hostname = hostname
+        self.lock = threading.Lock()
+        self.endpoints = dict()
+        self.phases = OrderedDict((p, 0.0) for p in PHASES)
+        self.stack = []
+        # the thread running the Context, a pool thread for multi-host runs
+        self.thread = threading.current_thread()
+        self.start = time.perf_counter()
+
+    def attach(self, client):
+        """Instruments all requests sent by the DockerClient"""
+        api = client.api
+        send = type(api).send
+
+        def profiled_send(request, **kwargs):
+            start = time.perf_counter()
+            try:
+                response = send(api, request, **kwargs)
+            except Exception:
+                self.record(request, None, time.perf_counter() - start)
+                raise
+            self.record(request, response, time.perf_counter() - start)
+            return response
+
+        # replaces any previous instrumentation of a client cached by docker_host
+        api.send = profiled_send
+        return client
+
+    def record(self, request, response, elapsed):
+        sent = len(request.body or b'') if request.body is not None and not hasattr(request.body, 'read') else 0
+        received = 0
+        if response is not None:
+            # streamed responses are not read yet, rely on the declared length
+            received = len(response.content) if response._content_consumed else int(response.headers.get('Content-Length', 0) or 0)
+        key = endpoint(request.method, request.url)
+        with self.lock:
+            stats = self.endpoints.get(key, None) or self.endpoints.setdefault(key, EndpointStats())
+            stats.calls += 1
+            stats.errors += response is None or response.status_code >= 400
+            stats.time += elapsed
+            stats.max = max(stats.max, elapsed)
+            stats.sent += sent
+            stats.received += received
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        if threading.current_thread() is not self.thread:
+            # workers (--parallel) overlap the phases, their time shows in the endpoints
+            yield
+            return
+        now = time.perf_counter()
+        if self.stack:
+            outer, since = self.stack[-1]
+            self.phases[outer] += now - since
+        self.stack.append([name, now])
+        try:
+            yield
+        finally:
+            now = time.perf_counter()
+            name, since = self.stack.pop()
+            self.phases[name] = self.phases.get(name, 0.0) + now - since
+            if self.stack:
+                self.stack[-1][1] = now
+
+    def as_dict(self):
+        return OrderedDict([
+            ('host', self.hostname),
+            ('total_ms', round((time.perf_counter() - self.start) * 1000, 1)),
+            ('phases_ms', OrderedDict((k, round(v * 1000, 1)) for k, v in self.phases.items())),
+            ('endpoints', OrderedDict((k, v.as_dict()) for k, v in sorted(self.endpoints.items()))),
+        ])
+
+    def write(self, filename):
+        with open(filename, 'w') as f:
+            json.dump(self.as_dict(), f, indent=2)
+
+    def print_summary(self):
+        data = self.as_dict()
+        print(f"Profile ({data['total_ms']:.1f} ms total)")
+        print('  ' + '  '.join(f'{k} {v:.1f} ms' for k, v in data['phases_ms'].items()))
+        if not self.endpoints:
+            return
+        width = max(len(k) for k in self.endpoints)
+        print(f"  {'endpoint':<{width}} {'calls':>6} {'errors':>6} {'total ms':>9} {'max ms':>8} {'sent':>9} {'received':>10}")
+        for key, stats in sorted(self.endpoints.items(), key=lambda e: e[1].time, reverse=True):
+            print(f'  {key:<{width}} {stats.calls:>6} {stats.errors:>6} {stats.time * 1000:>9.1f} {stats.max * 1000:>8.1f} {stats.sent:>9} {stats.received:>10}')
@@ -0,0 +1,194 @@
+# Compiling and parsing traefik router rules
+#
+# Hosts are kept as a list of plain names, wildcards ('*' matching any part)
+# and raw HostRegexp patterns (containing '{'). Rules are parsed back into the
+# same list, so hosts can be added and removed regardless of how the rule was
+# compiled, and conditions other than hosts (e.g. PathPrefix) are preserved.
+
+import re
+from collections import OrderedDict
+
+WILDCARD = '{domain:.+}'
+# plain hosts sharing a parent domain are merged into one regexp from this count on,
+# disabled by default as traefik only requests ACME certificates for Host() rules
+MERGE_MIN = 0
+
+# exact hosts (also when merged into a regexp) win over wildcards, which win over
+# catch-all rules, more specific conditions (longer path prefixes) win within each
+# class. Exact hosts and wildcards are compiled into separate rules, so each rule
+# has a single class, see compile_rules
+PRIORITY_EXACT = 3000
+PRIORITY_REGEXP = 2000
+PRIORITY_CATCHALL = 1000
+
+_MATCHER = re.compile(r'(Host|HostSNI|HostRegexp|HostSNIRegexp)\(\s*(`[^`]*`(?:\s*,\s*`[^`]*`)*)\s*\)')
+_MERGED = re.compile(r'\{\w+:\(\?:([a-z0-9_-]+(?:\|[a-z0-9_-]+)*)\)\}\.([^{}]+)')
+
+def split_routers(router, names):
+    """Returns the names of routers split off from router, in order"""
+    parts = [n for n in names if re.fullmatch(re.escape(router) + r'-r\d+', n)]
+    return sorted(parts, key=lambda n: int(n.rsplit('-r', 1)[1]))
+
+def normalize(hosts):
+    """Returns the hosts lowercased and without trailing dots and duplicates, in their original order"""
+    res = OrderedDict()
+    for h in hosts:
+        h = h.strip()
+        if '{' not in h:
+            h = h.lower().rstrip('.')
+        if h:
+            res[h] = None
+    return list(res)
+
+def _split(expr, op):
+    """Splits the expression on op outside of parentheses and quoted values"""
+    parts = []
+    depth = 0
+    quoted = False
+    start = 0
+    i = 0
+    while i < len(expr):
+        c = expr[i]
+        if c == '`':
+            quoted = not quoted
+        elif not quoted and c == '(':
+            depth += 1
+        elif not quoted and c == ')':
+            depth -= 1
+        elif not quoted and depth == 0 and expr.startswith(op, i):
+            parts.append(expr[start:i])
+            i += len(op)
+            start = i
+            continue
+        i += 1
+    parts.append(expr[start:])
+    return [p.strip() for p in parts]
+
+def _unwrap(expr):
+    """Strips parentheses enclosing the whole expression"""
+    while expr.startswith('(') and expr.endswith(')'):
+        depth = 0
+        quoted = False
+        for c in expr[:-1]:
+            if c == '`':
+                quoted = not quoted
+            elif not quoted:
+                depth += (c == '(') - (c == ')')
+                if depth == 0:
+                    # the first parenthesis closes before the end
+                    return expr
+        expr = expr[1:-1].strip()
+    return expr
+
+def expand_pattern(pattern):
+    """Converts a HostRegexp pattern back to hosts"""
+    match = _MERGED.fullmatch(pattern)
+    if match:
+        return [f'{p}.{match[2]}' for p in match[1].split('|')]
+    if pattern.replace(WILDCARD, '').count('{'):
+        return [pattern]
+    return [pattern.replace(WILDCARD, '*')]
+
+def _parse_hosts(expr):
+    """Returns hosts matched by an expression of ORed host matchers, None for other expressions"""
+    hosts = []
+    for term in _split(_unwrap(expr), '||'):
+        match = _MATCHER.fullmatch(_unwrap(term))
+        if not match:
+            return None
+        for arg in re.findall(r'`([^`]*)`', match[2]):
+            if match[1].endswith('Regexp'):
+                hosts += expand_pattern(arg)
+            elif arg != '*':
+                hosts.append(arg)
+    return hosts
+
+def parse_rule(rule):
+    """Returns the hosts matched by a rule and the remaining conditions"""
+    hosts = []
+    rest = []
+    if len(_split(rule or '', '||')) > 1:
+        # && binds tighter than ||, so only a rule consisting of host matchers can be split
+        found = _parse_hosts(rule)
+        return (found, '') if found is not None else ([], f'({rule})')
+    for part in _split(rule or '', '&&'):
+        found = _parse_hosts(part)
+        if found is None:
+            if part:
+                rest.append(part)
+        else:
+            hosts += found
+    if rest == ['PathPrefix(`/`)'] and not hosts:
+        # catch-all
+        rest = []
+    return hosts, ' && '.join(rest)
+
+def host_terms(hosts, merge_min=MERGE_MIN):
+    """Returns (term, is_regexp) pairs matching the hosts, merging hosts with a common parent domain"""
+    groups = OrderedDict()
+    for h in hosts:
+        if '*' in h or '{' in h:
+            groups[h] = None
+            continue
+        label, _, parent = h.partition('.')
+        key = parent if parent and merge_min and merge_min > 1 and re.fullmatch(r'[a-z0-9_-]+', label) else h
+        groups.setdefault(key, []).append(h)
+
+    terms = []
+    for key, members in groups.items():
+        if members is None:
+            terms.append((key if '{' in key else key.replace('*', WILDCARD), True))
+        elif len(members) >= max(merge_min or 0, 2):
+            labels = '|'.join(m.partition('.')[0] for m in members)
+            terms.append((f'{{host:(?:{labels})}}.{key}', True))
+        else:
+            terms += [(m, False) for m in members]
+    return terms
+
+def is_exact(term, regexp):
+    """Checks if a host term matches only exact hosts"""
+    return not regexp or bool(_MERGED.fullmatch(term))
+
+def build_rule(terms, rest='', tcp=False):
+    """Returns the rule matching the host terms and the remaining conditions, with its priority"""
+    matcher = 'HostSNI' if tcp else 'Host'
+    plain = [t for t, regexp in terms if not regexp]
+    patterns = [t for t, regexp in terms if regexp]
+    matchers = []
+    if plain:
+        matchers.append(f'{matcher}(`' + '`,`'.join(plain) + '`)')
+    if patterns:
+        matchers.append(f'{matcher}Regexp(`' + '`,`'.join(patterns) + '`)')
+
+    specificity = min(len(rest), 999)
+    if not matchers:
+        if tcp:
+            return 'HostSNI(`*`)', PRIORITY_CATCHALL
+        return rest or 'PathPrefix(`/`)', PRIORITY_CATCHALL + specificity
+
+    rule = ' || '.join(matchers)
+    if rest:
+        rule = f'({rule}) && {rest}' if len(matchers) > 1 else f'{rule} && {rest}'
+    exact = all(is_exact(t, regexp) for t, regexp in terms)
+    return rule, (PRIORITY_EXACT if exact else PRIORITY_REGEXP) + specificity
+
+def compile_rules(hosts, rest='', tcp=False, merge_min=MERGE_MIN, max_terms=None):
+    """Returns (rule, priority) pairs for the hosts, exact hosts first, split into rules
+    of at most max_terms host terms"""
+    # hosts of TCP routers are not merged, only wildcards use a regexp as before
+    terms = host_terms(normalize(hosts), 0 if tcp else merge_min)
+    groups = [g for g in ([t for t in terms if is_exact(*t)], [t for t in terms if not is_exact(*t)]) if g]
+    res = []
+    for group in groups or [[]]:
+        step = max_terms or len(group) or 1
+        res += [build_rule(group[i:i + step], rest, tcp) for i in range(0, max(len(group), 1), step)]
+    return res
+
+def rule_priority(rule):
+    """Returns the priority compile_rules() assigns to an existing rule"""
+    hosts, rest = parse_rule(rule)
+    return build_rule(host_terms(normalize(hosts), 0), rest)[1]
+
+def is_legacy_priority(rule, priority):
+    """Checks if the priority was computed from the rule length by older versions"""
+    return str(priority) in (str(len(rule)), str(len(rule) + 100))
@@ -0,0 +1,16 @@
+# Scoping label limiting the services traefik's docker provider has to evaluate
+
+from __future__ import annotations
+import typing
+if typing.TYPE_CHECKING:
+    from traefikswarm.dockertools import ServiceUpdater
+
+LABEL = 'traefikswarm.exposed'
+CONSTRAINT = f'Label(`{LABEL}`,`true`)'
+
+def stamp(svc: ServiceUpdater):
+    """Keeps the scoping label in sync with traefik.enable on the service"""
+    if svc.labels.get('traefik.enable', None) == 'true':
+        svc.ensure_label(LABEL, 'true')
+    else:
+        svc.remove_label(LABEL)